@@ -0,0 +1,103 @@
+# Batch simulation for game.py
+# Runs many independent headless worlds across a process pool and prints each world's metrics as it finishes
+#
+# Usage: python batch.py [--worlds 64] [--ticks 2000] [--workers N] [--policy wander|idle|thrower]
+#                        [--maps map.json,other.json] [--seed 0] [--out batch.jsonl]
+# Each world gets its own seed (seed + world number) and the maps are handed out in turn
+# Run it from the repo folder (sprites/ and map.json are loaded from there)
+
+import os
+import sys
+import json
+import time
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import game
+
+WORLDS = 64
+TICKS = 2000
+POLICY = "wander"
+OUT_FILE = "batch.jsonl"
+
+# Scripted input policies: called once per tick before the model updates
+def idle(model, rng, t):
+    pass
+
+def wander(model, rng, t):
+    if t % 15 == 0:
+        model.set_input(rng.choice([-game.LINK_SPEED, 0, game.LINK_SPEED]), rng.choice([-game.LINK_SPEED, 0, game.LINK_SPEED]))
+
+def thrower(model, rng, t):
+    wander(model, rng, t)
+    if t % 10 == 0:
+        model.throw_boomerang()
+
+POLICIES = {"idle": idle, "wander": wander, "thrower": thrower}
+
+# Pool workers start pygame once (dummy drivers, nothing is drawn)
+def init_worker():
+    game.init_headless()
+
+# Runs one world and returns its metrics
+# The map goes to this world's Model only (a worker runs many worlds, so nothing is set on the class)
+def run_world(job):
+    m = game.Model(seed=job["seed"], filename=job["map"])
+    policy = POLICIES[job["policy"]]
+    rng = random.Random(job["seed"])
+    start = time.perf_counter()
+    for t in range(job["ticks"]):
+        policy(m, rng, t)
+        m.update()
+    elapsed = time.perf_counter() - start
+    return {
+        "world": job["world"],
+        "map": job["map"],
+        "seed": job["seed"],
+        "policy": job["policy"],
+        "ticks": job["ticks"],
+        "rupees": m.rupees,
+        "anger_events": m.mood.angered,
+        "cuccos": len(m.cuccos),
+        "ticks_per_sec": job["ticks"] / elapsed if elapsed > 0 else None,
+        "state_hash": m.state_hash(),
+        "pid": os.getpid()
+    }
+
+# Runs the jobs on a process pool and yields each world's metrics as soon as it is done
+def run_batch(jobs, workers=None):
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        futures = [pool.submit(run_world, job) for job in jobs]
+        for f in as_completed(futures):
+            yield f.result()
+
+def make_jobs(worlds, ticks, policy, maps, seed):
+    return [{"world": i, "map": maps[i % len(maps)], "seed": seed + i, "policy": policy, "ticks": ticks} for i in range(worlds)]
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    worlds = int(args[args.index("--worlds") + 1]) if "--worlds" in args else WORLDS
+    ticks = int(args[args.index("--ticks") + 1]) if "--ticks" in args else TICKS
+    workers = int(args[args.index("--workers") + 1]) if "--workers" in args else os.cpu_count()
+    policy = args[args.index("--policy") + 1] if "--policy" in args else POLICY
+    maps = args[args.index("--maps") + 1].split(",") if "--maps" in args else [game.Model.filename]
+    seed = int(args[args.index("--seed") + 1]) if "--seed" in args else 0
+    out = args[args.index("--out") + 1] if "--out" in args else OUT_FILE
+    if policy not in POLICIES:
+        sys.exit(f"Unknown policy {policy} (pick one of {', '.join(POLICIES)})")
+
+    jobs = make_jobs(worlds, ticks, policy, maps, seed)
+    start = time.perf_counter()
+    done = 0
+    with open(out, "w") as f:
+        for r in run_batch(jobs, workers):
+            done += 1
+            f.write(json.dumps(r) + "\n")
+            f.flush()
+            print(f"[{done}/{worlds}] world {r['world']}: {r['rupees']} rupees, {r['anger_events']} anger events, {r['ticks_per_sec']:.1f} ticks/s")
+    elapsed = time.perf_counter() - start
+    print(f"{worlds} worlds x {ticks} ticks on {workers} workers in {elapsed:.1f}s ({worlds * ticks / elapsed:.0f} ticks/s total)")
+    print(f"Saved {out}")
+
+if __name__ == "__main__":
+    main()
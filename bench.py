@@ -0,0 +1,503 @@
+# Benchmarks for game.py
+# Builds synthetic worlds, runs them headless and saves the results to a JSON file
+#
+# Usage: python bench.py [--sizes 100,1000,10000,50000] [--ticks 100] [--render] [--flock] [--no-lod] [--out bench.json]
+#        (also records startup times: first frame and first playable frame of a fresh process)
+#        python bench.py --check-flock     (NumPy flock engine vs the plain cucco update, tick by tick)
+#        python bench.py --dispatch        (collision response cost per pair, is_* chain vs kind table)
+#        python bench.py --memory          (bytes per entity for each sprite type, plain __dict__ vs __slots__)
+#        python bench.py --hud             (HUD text cost per frame, font lookup + render vs cached surfaces)
+#        python bench.py --replay rec.json [--render]   (replays a game.py --record session as a fixed workload)
+#        python bench.py --map-load [100000]   (load time and peak memory of a big map, JSON vs binary)
+#        python bench.py --tunnel          (boomerangs stopped by a wall of trees or a far cucco at lower tick rates, swept vs end-position tests)
+# Run it from the repo folder (sprites/ and map.json are loaded from there)
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import gc
+import subprocess
+import resource
+import tempfile
+import tracemalloc
+
+import pygame
+import game
+
+SIZES = [100, 1000, 10000, 50000]
+TICKS = 100
+OUT_FILE = "bench.json"
+
+# Builds a world with n sprites (half trees, a fifth chests, the rest cuccos)
+def build_world(n, seed=0, flock=False):
+    random.seed(seed)
+    m = game.Model(flock=flock, seed=seed)
+    m.clear_map()
+    for k in range(n - len(m.sprites)):
+        x = random.uniform(0, game.WORLD_W - 80)
+        y = random.uniform(0, game.WORLD_H - 100)
+        r = k % 10
+        if r < 5:
+            m.add_sprite(game.Tree(x, y))
+        elif r < 7:
+            m.add_sprite(game.TreasureChest(x, y))
+        else:
+            m.add_sprite(m.make_cucco(x, y))
+    return m
+
+# Startup of a fresh game process on the dummy video driver, best of a few runs (seconds)
+# "sequential" is the old startup for comparison: Model and View built straight away, one image file at a time
+STARTUP = {
+    "parallel": "game.init_headless(); r = game.load_game(0, t)[2]",
+    "sequential": "game.init_headless(); m = game.Model(seed=0); v = game.View(m); v.update(); r = {'interactive': time.perf_counter() - t}"
+}
+
+def bench_startup(runs=3):
+    results = {}
+    for name, code in STARTUP.items():
+        script = "import time, json; t = time.perf_counter(); import game; " + code + "; print(json.dumps(r))"
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+            r = json.loads(out.strip().splitlines()[-1])
+            best = results.setdefault(name, r)
+            for k, v in r.items():
+                best[k] = min(best[k], v)
+    for name, r in results.items():
+        print(f"startup {name:>10}: " + "  ".join(f"{k} {1000 * v:.0f}ms" for k, v in r.items()))
+    return results
+
+# Runs one world size and returns its results
+def bench_size(n, ticks, render, flock=False, lod=True):
+    tracemalloc.start()
+    start = time.perf_counter()
+    m = build_world(n, flock=flock)
+    m.lod = lod
+    build_time = time.perf_counter() - start
+    world_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    v = game.View(m) if render else None
+    phases = {"sprites": 0.0, "collisions": 0.0, "camera": 0.0, "render": 0.0}
+    start = time.perf_counter()
+    for _ in range(ticks):
+        t0 = time.perf_counter()
+        m.update_sprites()
+        t1 = time.perf_counter()
+        m.handle_collisions()
+        t2 = time.perf_counter()
+        m.snap_camera()
+        t3 = time.perf_counter()
+        if v is not None:
+            v.update()
+        t4 = time.perf_counter()
+        phases["sprites"] += t1 - t0
+        phases["collisions"] += t2 - t1
+        phases["camera"] += t3 - t2
+        phases["render"] += t4 - t3
+    elapsed = time.perf_counter() - start
+
+    return {
+        "sprites": n,
+        "ticks": ticks,
+        "ticks_per_sec": ticks / elapsed if elapsed > 0 else None,
+        "build_sec": build_time,
+        "phase_ms_per_tick": {k: 1000 * t / ticks for k, t in phases.items()},
+        "cucco_updates_per_tick": {"near": m.lod_ticks[0] / ticks, "far": m.lod_ticks[1] / ticks},
+        "world_bytes": world_bytes,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+# Shared scenario: Link wanders and throws boomerangs through a crowd of cuccos until the flock gets angry
+# Returns the cucco positions and flock counters after every tick
+def flock_scenario(flock, ticks=600):
+    m = build_world(400, seed=7, flock=flock)
+    m.lod = False
+    r = random.Random(1)
+    for _ in range(30):
+        m.add_sprite(m.make_cucco(m.link.x + r.uniform(-150, 150), m.link.y + r.uniform(-150, 150)))
+    states = []
+    for t in range(ticks):
+        if t % 15 == 0:
+            m.link.set_input(r.choice([-game.LINK_SPEED, 0, game.LINK_SPEED]), r.choice([-game.LINK_SPEED, 0, game.LINK_SPEED]))
+        if t % 4 == 0:
+            m.throw_boomerang()
+        m.update()
+        cuccos = tuple((s.x, s.y, s.xdir, s.ydir, s.attached) for s in m.sprites if s.is_cucco())
+        states.append((cuccos, m.mood.angry, m.mood.hits, m.mood.count, m.mood.disappeared))
+    return states
+
+# Runs the scenario both ways and reports the first tick where they differ
+def check_flock(ticks=600):
+    plain = flock_scenario(False, ticks)
+    vectorized = flock_scenario(True, ticks)
+    for t, (a, b) in enumerate(zip(plain, vectorized)):
+        if a != b:
+            print(f"Flock engine differs from Cucco.update at tick {t}")
+            return False
+    print(f"Flock engine matches Cucco.update for {ticks} ticks")
+    return True
+
+# Throws boomerangs one at a time with the game running at the given tick rate (a lower rate moves everything further per tick)
+# The target is a wall of trees, or one cucco three rooms away from Link among 200 other far cuccos that stand still
+# (LOD only moves far cuccos every few ticks, so this also checks that boomerangs hit the ones that didn't move)
+# Returns how many of them the target stopped
+def tunnel_scenario(rate, continuous, target="trees", throws=50):
+    game.set_tick_rate(rate)
+    try:
+        m = game.Model(seed=0)
+        m.clear_map()
+        m.delete_items(list(m.cuccos))
+        m.continuous = continuous
+        if target == "trees":
+            for k in range(8):
+                m.add_sprite(game.Tree(600, 1200 + k * game.Tree.TREE_H))
+            right, top, step = 600 + game.Tree.TREE_W, 1250, 11
+        else:
+            m.lod = True
+            rng = random.Random(0)
+            crowd = [m.add_sprite(m.make_cucco(rng.randrange(1800, 3400), rng.randrange(2400, 2900))) for _ in range(200)]
+            cucco = m.add_sprite(m.make_cucco(2600, 400))
+            for c in crowd + [cucco]:
+                c.roam_speed = 0
+            right, top, step = cucco.x + cucco.w, 380, 4
+        stopped = 0
+        for k in range(throws):
+            if target != "trees":
+                m.mood.hits = 0     # Keeps the flock calm so the target stays put
+            m.link.x, m.link.y = 200 + k * 7, top + k % 8 * step if target != "trees" else top + k * step
+            m.link.set_input(game.LINK_SPEED, 0)
+            m.link.set_input(0, 0)
+            m.throw_boomerang()
+            b = m.projectiles[-1]
+            while b in m.projectiles:
+                m.update()
+            stopped += b.x < right
+    finally:
+        game.set_tick_rate(game.TUNED_TICK_RATE)
+    return stopped
+
+def bench_tunnel(rates=(25, 12.5, 5, 2.5, 1), throws=50):
+    results = []
+    for target in ("trees", "cucco"):
+        for rate in rates:
+            r = {"target": target, "tick_rate": rate, "speed": game.TUNED["BOOMERANG_SPEED"] * game.TUNED_TICK_RATE / rate,
+                 "end_position": tunnel_scenario(rate, False, target, throws), "swept": tunnel_scenario(rate, True, target, throws)}
+            print(f"{target:>5} {rate:>4} ticks/s ({r['speed']:>3.0f} px/tick): stopped {r['end_position']}/{throws} end-position,"
+                  f" {r['swept']}/{throws} swept")
+            results.append(r)
+    for continuous in (False, True):
+        m = build_world(10000, seed=3)
+        m.continuous = continuous
+        start = time.perf_counter()
+        for _ in range(50):
+            m.update()
+        print(f"10000 sprites, swept {'on ' if continuous else 'off'}: {50 / (time.perf_counter() - start):.1f} ticks/s")
+    return results
+
+# The is_* chain collision responses went through before the collision table (kept to measure against)
+def chain_collide(model, a, b):
+    if a.is_link() and (b.is_tree() or (b.is_chest() and b.is_item())):
+        a.push_back(b)
+    elif b.is_link() and (a.is_tree() or (a.is_chest() and a.is_item())):
+        b.push_back(a)
+    if a.is_link() and b.is_chest():
+        if not b.opened:
+            a.push_back(b); model._open_chest(b)
+        elif b.can_collect():
+            model._collect_rupee(b)
+    elif b.is_link() and a.is_chest():
+        if not a.opened:
+            b.push_back(a); model._open_chest(a)
+        elif a.can_collect():
+            model._collect_rupee(a)
+    if a.is_boomerang() and b.is_tree():
+        a.kill()
+    elif b.is_boomerang() and a.is_tree():
+        b.kill()
+    if a.is_boomerang() and b.is_chest():
+        if not b.opened:
+            model._open_chest(b)
+        else:
+            model._collect_rupee(b)
+            a.kill()
+    elif b.is_boomerang() and a.is_chest():
+        if not a.opened:
+            model._open_chest(a)
+        else:
+            model._collect_rupee(a)
+            b.kill()
+    def cucco_bounce(cucco, item):
+        if isinstance(cucco, game.Cucco) and not model.mood.angry:
+            cucco._bounce_from_item(item)
+    if a.is_cucco() and (b.is_tree() or b.is_chest()):
+        cucco_bounce(a, b)
+    elif b.is_cucco() and (a.is_tree() or a.is_chest()):
+        cucco_bounce(b, a)
+    if a.is_cucco() and b.is_link():
+        if not model.mood.angry:
+            a._bounce_from_item(b)
+        a.is_hit()
+        if model.mood.angry:
+            a.attach_to_link(model.timers)
+    elif b.is_cucco() and a.is_link():
+        if not model.mood.angry:
+            b._bounce_from_item(a)
+        b.is_hit()
+        if model.mood.angry:
+            b.attach_to_link(model.timers)
+    if a.is_boomerang() and b.is_cucco():
+        b.is_hit(); a.kill()
+        if model.mood.angry:
+            b.attach_to_link(model.timers)
+    elif b.is_boomerang() and a.is_cucco():
+        a.is_hit(); b.kill()
+        if model.mood.angry:
+            a.attach_to_link(model.timers)
+
+# Times the narrowphase and response step for every broadphase candidate pair of a 10k-sprite world
+# Both ways only respond to overlapping pairs, like Model.handle_collisions (the chain tests every pair, the table skips
+# the overlap test for kinds that never react)
+def bench_dispatch(n=10000, rounds=20):
+    results = {}
+    for name in ("chain", "table"):
+        m = build_world(n)
+        for _ in range(20):
+            m.throw_boomerang()
+        pairs = [(m.sprites[i], m.sprites[j]) for i, j in m._candidate_pairs()]
+        start = time.perf_counter()
+        for _ in range(rounds):
+            if name == "chain":
+                for a, b in pairs:
+                    if game.aabb_collide(a, b):
+                        chain_collide(m, a, b)
+            else:
+                for a, b in pairs:
+                    handler = game.COLLISIONS.get((a.KIND, b.KIND))
+                    if handler is not None and game.aabb_collide(a, b):
+                        handler(m, a, b)
+        results[name] = 1e9 * (time.perf_counter() - start) / (rounds * len(pairs))
+        print(f"{name:>6}: {results[name]:.0f} ns per pair ({len(pairs)} pairs)")
+    return results
+
+# Bytes allocated per instance (the first one is made up front so shared frames aren't counted)
+def bytes_per(make, n=2000):
+    make(0)
+    gc.collect()
+    tracemalloc.start()
+    keep = [make(i) for i in range(n)]
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return used / len(keep)
+
+# Sprites the way they were stored before __slots__ (kept to measure against): the same fields in a per-instance
+# __dict__, plus the frame tables every Link, cucco, boomerang and chest used to build for itself
+class DictSprite():
+    FRAMES = {
+        "Link": lambda s: {"frames": list(s.frames), "dirBase": dict(s.dirBase)},
+        "Cucco": lambda s: {"images_left": list(s.images_left), "images_right": list(s.images_right),
+                            "angry_left": list(s.angry_left), "angry_right": list(s.angry_right)},
+        "Boomerang": lambda s: {"frames": list(s.frames)},
+        "TreasureChest": lambda s: {"_rupee_img": s.rupee_img}
+    }
+
+    def __init__(self, sprite):
+        for cls in type(sprite).__mro__:
+            for name in cls.__dict__.get("__slots__", ()):
+                if hasattr(sprite, name):
+                    setattr(self, name, getattr(sprite, name))
+        frames = self.FRAMES.get(type(sprite).__name__)
+        if frames is not None:
+            for name, value in frames(sprite).items():
+                setattr(self, name, value)
+
+def bench_memory():
+    m = game.Model()
+    m.clear_map()
+    types = {
+        "Tree": lambda i: game.Tree(i, i),
+        "TreasureChest": lambda i: game.TreasureChest(i, i),
+        "Cucco": lambda i: game.Cucco(i, i, m.mood),
+        "Boomerang": lambda i: game.Boomerang(i, i, "left"),
+        "Link": lambda i: game.Link(i, i)
+    }
+    results = {}
+    for name, make in types.items():
+        plain = type("Dict" + name, (DictSprite,), {})     # One class per type, like the originals (dicts share keys per class)
+        before = bytes_per(lambda i: plain(make(i)))
+        after = bytes_per(make)
+        results[name] = {"dict": before, "slots": after}
+        print(f"{name:>14}: {before:.0f} -> {after:.0f} bytes (__dict__ -> __slots__)")
+    if game.np is not None:
+        flock = game.Flock(m.mood)
+        results["FlockCucco"] = {"slots": bytes_per(lambda i: flock.spawn(i, i))}
+        print(f"{'FlockCucco':>14}: {results['FlockCucco']['slots']:.0f} bytes")
+    return results
+
+# Loads a random n-entity map saved as JSON and as binary: parse only, then the whole Model.load_map
+def bench_map_load(n=100000, seed=0):
+    rng = random.Random(seed)
+    data = {kind: [{"x": rng.randrange(game.WORLD_W), "y": rng.randrange(game.WORLD_H)} for _ in range(n * share // 10)]
+            for kind, share in zip(game.MAP_TABLES, (5, 3, 2))}
+    data["linkx"], data["linky"] = 200, 300
+    folder = tempfile.mkdtemp()
+    results = {}
+    try:
+        m = game.Model()
+        for ext in (".json", game.MAP_BINARY_EXT):
+            path = os.path.join(folder, "map" + ext)
+            game.write_map_atomic(path, data)
+            tracemalloc.start()
+            start = time.perf_counter()
+            if game.is_binary_map(path):
+                with game.MapFile(path) as mf:
+                    for kind in game.MAP_TABLES:
+                        for _ in mf.positions(kind):
+                            pass
+            else:
+                game.read_map(path)
+            parse = time.perf_counter() - start
+            parse_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+            m.filename = path
+            start = time.perf_counter()
+            m.load_map()
+            load = time.perf_counter() - start
+            load_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[ext] = {"bytes": os.path.getsize(path), "parse_ms": 1000 * parse, "parse_peak": parse_peak,
+                            "load_ms": 1000 * load, "load_peak": load_peak}
+            print(f"{ext:>6}: {results[ext]['bytes'] / 1e6:.1f} MB on disk  parse {results[ext]['parse_ms']:.0f}ms"
+                  f" (peak {parse_peak / 1e6:.1f} MB)  load_map {results[ext]['load_ms']:.0f}ms (peak {load_peak / 1e6:.1f} MB)")
+            m.load_map({})      # Empty world again so the next format starts from the same state
+    finally:
+        for name in os.listdir(folder):
+            os.remove(os.path.join(folder, name))
+        os.rmdir(folder)
+    return results
+
+# HUD the way View.update drew it before the text cache (font looked up and both strings rendered every frame)
+def hud_uncached(view):
+    font = pygame.font.SysFont(None, 32)
+    text = f"Rupees: {view.model.rupees}    Mode: {'EDIT' if view.model.edit_mode else 'GAME'} Add: {view.model.add_type}"
+    surf = font.render(text, True, (0, 0, 0))
+    view.screen.blit(surf, (game.VIEW_W - surf.get_width() - 12, 10))
+    if view.model.edit_mode:
+        pygame.draw.rect(view.screen, (235, 255, 235), game.EDIT_BOX, border_radius = 8)
+        pygame.draw.rect(view.screen, (30, 120, 30), game.EDIT_BOX, 2, border_radius = 8)
+        view.screen.blit(font.render("Click to cycle item", True, (0, 60, 0)), (game.EDIT_BOX.x + 8, game.EDIT_BOX.y + 8))
+        sprite = view.model.sprite[view.model.add_type]
+        scale = min((game.EDIT_BOX.width - 20) / sprite.get_width(), (game.EDIT_BOX.height - 30) / sprite.get_height(), 1.0)
+        pw, ph = max(1, int(sprite.get_width() * scale)), max(1, int(sprite.get_height() * scale))
+        view.screen.blit(game.SCALED.get(sprite, pw, ph), (game.EDIT_BOX.x + (game.EDIT_BOX.width - pw) // 2, game.EDIT_BOX.bottom - ph - 6))
+
+# Times the HUD for a run of edit-mode frames (rupees change every 50 frames), old way vs View._draw_hud
+def bench_hud(frames=600):
+    m = game.Model()
+    v = game.View(m)
+    m.edit_mode = True
+    results = {}
+    for name, draw in (("uncached", hud_uncached), ("cached", game.View._draw_hud)):
+        m.rupees = 0
+        start = time.perf_counter()
+        for f in range(frames):
+            if f % 50 == 0:
+                m.rupees += 1
+            draw(v)
+        results[name] = 1000 * (time.perf_counter() - start) / frames
+    m.edit_mode = False
+    results["saved"] = results["uncached"] - results["cached"]
+    for name, ms in results.items():
+        print(f"{name:>9}: {ms:.3f} ms per frame")
+    return results
+
+# Replays a recorded session a few times and reports its speed (fails if the final state ever differs)
+def bench_replay(path, render=False, runs=3):
+    best = 0.0
+    for _ in range(runs):
+        m, tps, ok = game.replay(path, render)
+        if not ok:
+            print(f"{path}: final state differs from the recording")
+            return None
+        best = max(best, tps)
+    print(f"{path}: {m.timers.tick} ticks, best of {runs}: {best:.1f} ticks/s")
+    return best
+
+# Prints the change in ticks per second against the last saved run
+def compare(results, path):
+    try:
+        with open(path) as f:
+            old = {r["sprites"]: r for r in json.load(f)["results"]}
+    except (FileNotFoundError, ValueError, KeyError):
+        return
+    for r in results:
+        prev = old.get(r["sprites"])
+        if prev and prev.get("ticks_per_sec") and r["ticks_per_sec"]:
+            change = 100 * (r["ticks_per_sec"] / prev["ticks_per_sec"] - 1)
+            print(f"  {r['sprites']:>6} sprites: {change:+.1f}% ticks/s vs last run")
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    sizes = SIZES
+    ticks = TICKS
+    out = OUT_FILE
+    render = "--render" in args
+    flock = "--flock" in args
+    lod = "--no-lod" not in args
+    if "--sizes" in args:
+        sizes = [int(n) for n in args[args.index("--sizes") + 1].split(",")]
+    if "--ticks" in args:
+        ticks = int(args[args.index("--ticks") + 1])
+    if "--out" in args:
+        out = args[args.index("--out") + 1]
+
+    game.init_headless()
+    if "--check-flock" in args:
+        sys.exit(0 if check_flock() else 1)
+    if "--dispatch" in args:
+        bench_dispatch()
+        return
+    if "--memory" in args:
+        bench_memory()
+        return
+    if "--hud" in args:
+        bench_hud()
+        return
+    if "--tunnel" in args:
+        bench_tunnel()
+        return
+    if "--map-load" in args:
+        i = args.index("--map-load") + 1
+        bench_map_load(int(args[i]) if i < len(args) and args[i].isdigit() else 100000)
+        return
+    if "--replay" in args:
+        sys.exit(0 if bench_replay(args[args.index("--replay") + 1], render) else 1)
+
+    startup = bench_startup()
+    results = []
+    for n in sizes:
+        r = bench_size(n, ticks, render, flock, lod)
+        phases = "  ".join(f"{k} {ms:.2f}ms" for k, ms in r["phase_ms_per_tick"].items())
+        lod_tiers = r["cucco_updates_per_tick"]
+        print(f"{n:>6} sprites: {r['ticks_per_sec']:.1f} ticks/s  {phases}  {r['world_bytes'] / 1e6:.1f} MB  cuccos moved {lod_tiers['near']:.0f} near / {lod_tiers['far']:.0f} far per tick")
+        results.append(r)
+
+    compare(results, out)
+    data = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "render": render,
+        "flock": flock,
+        "lod": lod,
+        "startup": startup,
+        "results": results
+    }
+    with open(out, "w") as f:
+        json.dump(data, f, indent=2)
+    print(f"Saved {out}")
+
+if __name__ == "__main__":
+    main()
@@ -3,41 +3,524 @@
 # Date: 12/01/25
 # Assignment 7 
 
+import os
+import sys
+import glob
 import pygame
 import time
 import json
 import math
+import mmap
+import struct
+import hashlib
 import random
+import stat
+import tempfile
+import threading
+
+from array import array
+from collections import OrderedDict, deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# NumPy is optional (only the flock engine needs it)
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from pygame.locals import *
 from time import sleep
 
 # Constants
 SPRITES_DIR = "sprites/"    # Holds all sprite images
+ATLAS_IMAGE = SPRITES_DIR + "atlas.png"     # Every sprite packed into one image (python game.py --atlas)
+ATLAS_INDEX = SPRITES_DIR + "atlas.json"    # Where each sprite sits in the atlas
 VIEW_W = 800                # Room width
 VIEW_H = 600                # Room height
 WORLD_W = 3500              # World Width
 WORLD_H = 3000              # World Height
+DEFAULT_WORLD_SIZE = (WORLD_W, WORLD_H)     # Size of JSON and binary maps (a map folder stores its own)
 LINK_SPEED = 9              # Link speed
 BOOMERANG_SPEED = 8         # Boomerang speed
 RUPEE_DELAY = 5             # Frames before rupee becomes collectible
 RUPEE_TTL = 40              # Rupee timespan
-FPS_DELAY = 0.04
+TICK_RATE = 25              # Simulation ticks per second
+RENDER_RATE = 30            # Max frames drawn per second
+MAX_CATCHUP_TICKS = 5       # Ticks run back to back before the loop gives up catching up
+MAX_SKIPPED_RENDERS = 1     # Due frames skipped in a row while catching up before one is drawn anyway
+TUNED_TICK_RATE = 25        # Tick rate the per-tick speeds and durations were tuned for (set_tick_rate rescales them)
+CELL_SIZE = 128             # Broadphase grid cell (a bit bigger than the largest sprite)
+USE_BROADPHASE = True       # False falls back to testing every pair
+USE_SWEPT = True            # Fast movers are also tested along their path this tick, so they can't pass through things
+SWEPT_MIN_TRAVEL = 24       # Pixels per tick that make a mover fast (the smallest sprite is 24 wide, so slower pairs can't pass through each other)
+BG_CACHE_ROOMS = 12         # Pre-rendered room backgrounds kept in memory
+BOOMERANG_POOL = 32         # Boomerangs that can be in flight at once
+USE_FLOCK_ENGINE = False    # True moves all cuccos with NumPy array math (needs numpy)
+USE_LOD = True              # Cuccos far from Link's room move less often, in bigger steps
+LOD_NEAR_RADIUS = 1         # Rooms around Link's room where cuccos move every tick
+LOD_FAR_STEP = 4            # Ticks between moves for cuccos farther out (boomerangs still test the ones that didn't move)
+CHUNK_LOAD_RADIUS = 1       # Rooms around Link kept loaded from a chunked map
+CHUNK_KEEP_RADIUS = 2       # Loaded rooms farther than this are written back and dropped
+AUTOSAVE = False            # True journals edits and saves them in the background
+AUTOSAVE_TICKS = 250        # Ticks between autosaves
+JOURNAL_COMPACT = 200       # Journal entries before they are folded into a full save
+MAP_BINARY_EXT = ".lkm"     # New maps with this extension are saved in the binary format (python game.py --convert)
+PRELOAD_WORKERS = 4         # Threads decoding sprite images at startup
+BRUSH_SPACING = 80          # Pixels between items placed by one brush stroke
+BRUSH_OVERLAP = False       # True lets the brush place items on top of trees and chests
 EDIT_BOX = pygame.Rect(10, 10, 220, 60) # Edit box
 
+# Image cache
+# Every image is decoded once and the same surface is shared by all sprites that use it
+# max_size limits how many images are kept (least recently used is dropped first)
+class AssetCache():
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.images = OrderedDict()     # path -> (surface, converted)
+        self.loading = {}               # path -> Future of an image still decoding on the preload pool
+        self.hits = 0
+        self.misses = 0
+
+    # Starts decoding images on a thread pool and returns their futures (get() waits for one it needs)
+    # Workers only decode; converting and caching stay on the main thread
+    def preload(self, paths, workers=PRELOAD_WORKERS):
+        pool = ThreadPoolExecutor(max_workers=workers)
+        futures = []
+        for path in paths:
+            if path not in self.images and path not in self.loading:
+                self.loading[path] = pool.submit(pygame.image.load, path)
+                futures.append(self.loading[path])
+        pool.shutdown(wait=False)
+        return futures
+
+    def get(self, path):
+        entry = self.images.get(path)
+        if entry is not None:
+            self.hits += 1
+            self.images.move_to_end(path)
+            img, converted = entry
+
+            # Images loaded before the window opened get converted once it exists
+            if not converted and pygame.display.get_surface():
+                SCALED.invalidate(img)
+                img = img.convert_alpha()
+                self.images[path] = (img, True)
+            return img
+
+        self.misses += 1
+        pending = self.loading.pop(path, None)
+        img = pending.result() if pending is not None else pygame.image.load(path)
+        converted = pygame.display.get_surface() is not None
+        if converted:
+            img = img.convert_alpha()
+        self.images[path] = (img, converted)
+        if self.max_size is not None:
+            while len(self.images) > self.max_size:
+                _, (old, _) = self.images.popitem(last=False)
+                SCALED.invalidate(old)
+        return img
+
+    def clear(self):
+        self.images.clear()
+        self.loading.clear()
+        self.hits = 0
+        self.misses = 0
+        SCALED.invalidate()
+
+    def stats(self):
+        return {"size": len(self.images), "hits": self.hits, "misses": self.misses}
+
+# Scaled image cache
+# Holds each image already scaled to the sizes it is drawn at, so frames only blit
+class ScaledCache():
+    def __init__(self):
+        self.images = {}    # (id(source), w, h) -> (source, scaled)
+
+    def get(self, img, w, h):
+        key = (id(img), w, h)
+        entry = self.images.get(key)
+        if entry is None or entry[0] is not img:
+            scaled = img if img.get_size() == (w, h) else pygame.transform.scale(img, (w, h))
+            entry = (img, scaled)
+            self.images[key] = entry
+        return entry[1]
+
+    # Drops the scaled copies of one source image (or all of them)
+    def invalidate(self, img=None):
+        if img is None:
+            self.images.clear()
+            return
+        for key in [k for k, e in self.images.items() if e[0] is img]:
+            del self.images[key]
+
+# Rendered text cache
+# Keeps text surfaces keyed by their string and color, so text that hasn't changed is never rendered again
+class TextCache():
+    def __init__(self, size, max_size=64):
+        self.size = size
+        self.font = None                # Made on first use (pygame.font has to be initialised)
+        self.max_size = max_size
+        self.images = OrderedDict()     # (text, color) -> surface
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, color):
+        key = (text, color)
+        img = self.images.get(key)
+        if img is not None:
+            self.hits += 1
+            self.images.move_to_end(key)
+            return img
+
+        self.misses += 1
+        if self.font is None:
+            self.font = pygame.font.SysFont(None, self.size)
+        img = self.font.render(text, True, color)
+        self.images[key] = img
+        while len(self.images) > self.max_size:
+            self.images.popitem(last=False)
+        return img
+
+# Texture atlas
+# Frames are subsurfaces of one atlas image, so they share its pixels instead of each being a separate surface
+# Sprites missing from the index (or edited since the atlas was built) are loaded from their own files
+class Atlas():
+    def __init__(self, image_path=ATLAS_IMAGE, index_path=ATLAS_INDEX):
+        self.image_path = image_path
+        self.index_path = index_path
+        self.regions = None     # file name -> (x, y, w, h), read on first use ({} when there is no atlas)
+        self.sheet = None
+        self.frames = {}        # file name -> subsurface of sheet
+
+    def _read_index(self):
+        self.regions = {}
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        folder = os.path.dirname(self.image_path)
+        for name, e in index["frames"].items():
+            try:
+                if os.path.getmtime(os.path.join(folder, name)) > e["mtime"]:
+                    continue
+            except OSError:
+                pass
+            self.regions[name] = tuple(e["rect"])
+
+    # Subsurface for an image path, or None when it isn't in the atlas
+    def get(self, path):
+        if self.regions is None:
+            self._read_index()
+        if os.path.normpath(os.path.dirname(path)) != os.path.normpath(os.path.dirname(self.image_path)):
+            return None
+        name = os.path.basename(path)
+        rect = self.regions.get(name)
+        if rect is None:
+            return None
+
+        # The asset cache converts the sheet once the window exists (old frames keep the old sheet alive)
+        sheet = ASSETS.get(self.image_path)
+        if sheet is not self.sheet:
+            self.sheet = sheet
+            self.frames = {}
+        frame = self.frames.get(name)
+        if frame is None:
+            frame = sheet.subsurface(rect)
+            self.frames[name] = frame
+        return frame
+
+    # Names of the images packed in the atlas
+    def packed(self):
+        if self.regions is None:
+            self._read_index()
+        return self.regions
+
+    def clear(self):
+        self.regions = None
+        self.sheet = None
+        self.frames = {}
+
+# Every image file the game loads (just the atlas sheet for the ones packed in it)
+def startup_images():
+    packed = ATLAS.packed()
+    paths = [SPRITES_DIR + n for n in sorted(os.listdir(SPRITES_DIR))
+             if n.endswith(".png") and SPRITES_DIR + n != ATLAS_IMAGE and n not in packed]
+    return ([ATLAS_IMAGE] if packed else []) + paths
+
+# Packs every image in a folder into one atlas image and writes its index (shelf packing, tallest first)
+def build_atlas(folder=SPRITES_DIR, image_path=ATLAS_IMAGE, index_path=ATLAS_INDEX, max_w=1024, pad=1):
+    names = sorted(n for n in os.listdir(folder) if n.endswith(".png") and os.path.join(folder, n) != image_path)
+    images = {n: pygame.image.load(os.path.join(folder, n)) for n in names}
+    rects = {}
+    x = y = shelf = 0
+    for n in sorted(names, key=lambda n: (-images[n].get_height(), n)):
+        w, h = images[n].get_size()
+        if x > 0 and x + w > max_w:
+            x = 0
+            y += shelf + pad
+            shelf = 0
+        rects[n] = (x, y, w, h)
+        x += w + pad
+        shelf = max(shelf, h)
+
+    # BLEND_RGBA_MAX onto a transparent sheet copies per-pixel alpha exactly (a normal blit would blend the edges)
+    # Colorkeyed and opaque images are blitted normally, which leaves their keyed pixels transparent
+    sheet = pygame.Surface((max(r[0] + r[2] for r in rects.values()), y + shelf), pygame.SRCALPHA)
+    sheet.fill((0, 0, 0, 0))
+    for n, r in rects.items():
+        img = images[n]
+        sheet.blit(img, r[:2], special_flags=pygame.BLEND_RGBA_MAX if img.get_flags() & pygame.SRCALPHA else 0)
+    pygame.image.save(sheet, image_path)
+    write_json_atomic(index_path, {
+        "image": os.path.basename(image_path),
+        "frames": {n: {"rect": list(rects[n]), "mtime": os.path.getmtime(os.path.join(folder, n))} for n in names}
+    })
+    ATLAS.clear()
+    return sheet.get_size(), len(names)
+
+ASSETS = AssetCache()
+SCALED = ScaledCache()
+ATLAS = Atlas()
+
 # Loads Sprites
 # Convert_alpha() converts images to the same pixel format
+# Sprites packed into the texture atlas come back as subsurfaces of it
 def load_image(path):
-    img = pygame.image.load(path)
-    return img.convert_alpha() if pygame.display.get_surface() else img
+    img = ATLAS.get(path)
+    return img if img is not None else ASSETS.get(path)
+
+# Changes the world size (chunked maps store their own size)
+def set_world_size(w, h):
+    global WORLD_W, WORLD_H
+    WORLD_W = int(w)
+    WORLD_H = int(h)
+
+# Camera position for a room (clamped so the view stays inside the world)
+def room_camera(roomX, roomY):
+    return (max(0, min(roomX * VIEW_W, WORLD_W - VIEW_W)),
+            max(0, min(roomY * VIEW_H, WORLD_H - VIEW_H)))
 
 # Handles collision
 def aabb_collide(a, b):
     return not (a.x + a.w <= b.x or a.x >= b.x + b.w or a.y + a.h <= b.y or a.y >= b.y + b.h)
 
+# Swept AABB: both boxes move in a straight line from where they started the tick (start_pos) to where they are now
+# Returns (time of impact 0..1, side of b that a ran into) for the first touch during the tick,
+# or None when they never meet or already overlapped at the start
+def sweep_aabb(a, b):
+    ax, ay = a.start_pos()
+    bx, by = b.start_pos()
+    vx = (a.x - ax) - (b.x - bx)
+    vy = (a.y - ay) - (b.y - by)
+    if vx > 0:
+        tx0, tx1 = (bx - ax - a.w) / vx, (bx + b.w - ax) / vx
+    elif vx < 0:
+        tx0, tx1 = (bx + b.w - ax) / vx, (bx - ax - a.w) / vx
+    elif ax + a.w <= bx or ax >= bx + b.w:
+        return None
+    else:
+        tx0, tx1 = -math.inf, math.inf
+    if vy > 0:
+        ty0, ty1 = (by - ay - a.h) / vy, (by + b.h - ay) / vy
+    elif vy < 0:
+        ty0, ty1 = (by + b.h - ay) / vy, (by - ay - a.h) / vy
+    elif ay + a.h <= by or ay >= by + b.h:
+        return None
+    else:
+        ty0, ty1 = -math.inf, math.inf
+    t0 = max(tx0, ty0)
+    if t0 < 0 or t0 >= 1 or t0 >= min(tx1, ty1):
+        return None
+    if tx0 > ty0:
+        return t0, "left" if vx > 0 else "right"
+    return t0, "top" if vy > 0 else "bottom"
+
+# Side of b that a's path crossed this tick, or None if a was already inside b when the tick started
+# (nothing is pushed then, so a push never moves a sprite further than it travelled this tick)
+def contact_side(a, b):
+    hit = sweep_aabb(a, b)
+    return hit[1] if hit is not None else None
+
+# Pixels a sprite moved this tick along its longer axis
+def travel(s):
+    sx, sy = s.start_pos()
+    return max(abs(s.x - sx), abs(s.y - sy))
+
+# Spatial hash
+# Buckets sprites into a uniform grid over the world so only nearby sprites get collision tested
+class SpatialHash():
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell = cell_size
+        self.cols = int(math.ceil(WORLD_W / cell_size))
+        self.rows = int(math.ceil(WORLD_H / cell_size))
+        self.buckets = {}
+
+    # Grid cells covered by a sprite (sprites outside the world land in the edge cells)
+    def _cells(self, s, margin=0):
+        x0 = min(max(int((s.x - margin) // self.cell), 0), self.cols - 1)
+        y0 = min(max(int((s.y - margin) // self.cell), 0), self.rows - 1)
+        x1 = min(max(int((s.x + s.w + margin) // self.cell), 0), self.cols - 1)
+        y1 = min(max(int((s.y + s.h + margin) // self.cell), 0), self.rows - 1)
+        for cy in range(y0, y1 + 1):
+            for cx in range(x0, x1 + 1):
+                yield (cx, cy)
+
+    # margin files the sprite under the cells around it too (a grid that is rebuilt every tick never removes it)
+    def insert(self, s, margin=0):
+        for c in self._cells(s, margin):
+            self.buckets.setdefault(c, []).append(s)
+
+    # Sprite must still be where it was inserted
+    def remove(self, s):
+        for c in self._cells(s):
+            bucket = self.buckets.get(c)
+            if bucket and s in bucket:
+                bucket.remove(s)
+                if not bucket:
+                    del self.buckets[c]
+
+    # Sprites sharing a cell with s (margin widens the search area)
+    def query(self, s, margin=0):
+        found = {}
+        for c in self._cells(s, margin):
+            for o in self.buckets.get(c, ()):
+                if o is not s:
+                    found[id(o)] = o
+        return found.values()
+
+    def clear(self):
+        self.buckets.clear()
+
+# Timer wheel
+# Runs callbacks a number of ticks from now; each tick only looks at the events in one slot
+class TimerWheel():
+    def __init__(self, slots=64):
+        self.tick = 0
+        self.slots = [[] for _ in range(slots)]
+        self.pending = 0
+
+    def schedule(self, delay, fn):
+        due = self.tick + max(1, delay)
+        self.slots[due % len(self.slots)].append((due, fn))
+        self.pending += 1
+
+    # Moves to the next tick and fires its events (events a full lap or more away stay put)
+    def advance(self):
+        self.tick += 1
+        slot = self.slots[self.tick % len(self.slots)]
+        if not slot:
+            return
+        due = [fn for t, fn in slot if t == self.tick]
+        slot[:] = [e for e in slot if e[0] != self.tick]
+        self.pending -= len(due)
+        for fn in due:
+            fn()
+
+    def clear(self):
+        for slot in self.slots:
+            slot.clear()
+        self.pending = 0
+
+# Room index
+# Tracks which rooms (VIEW_W x VIEW_H cells) each sprite overlaps so the view only draws the current room
+class RoomIndex():
+    def __init__(self):
+        self.rooms = {}     # (roomX, roomY) -> {id(sprite): sprite}
+        self.where = {}     # id(sprite) -> rooms spanned (rx0, ry0, rx1, ry1)
+        self.order = {}     # id(sprite) -> insertion number (keeps the model's draw order)
+        self.count = 0
+
+    def _span(self, s):
+        return (int(s.x // VIEW_W), int(s.y // VIEW_H), int((s.x + s.w) // VIEW_W), int((s.y + s.h) // VIEW_H))
+
+    # Adds a sprite or moves it to the rooms it now overlaps
+    def update(self, s):
+        span = self._span(s)
+        old = self.where.get(id(s))
+        if old == span:
+            return
+        if old is None:
+            self.order[id(s)] = self.count
+            self.count += 1
+        else:
+            self._unlink(s, old)
+        self.where[id(s)] = span
+        for ry in range(span[1], span[3] + 1):
+            for rx in range(span[0], span[2] + 1):
+                self.rooms.setdefault((rx, ry), {})[id(s)] = s
+
+    def remove(self, s):
+        old = self.where.pop(id(s), None)
+        if old is not None:
+            self._unlink(s, old)
+            del self.order[id(s)]
+
+    def _unlink(self, s, span):
+        for ry in range(span[1], span[3] + 1):
+            for rx in range(span[0], span[2] + 1):
+                room = self.rooms.get((rx, ry))
+                if room is not None:
+                    room.pop(id(s), None)
+                    if not room:
+                        del self.rooms[(rx, ry)]
+
+    # Sprites overlapping a world rectangle, in the order they were added
+    def visible(self, x, y, w, h):
+        found = {}
+        for ry in range(int(y // VIEW_H), int((y + h) // VIEW_H) + 1):
+            for rx in range(int(x // VIEW_W), int((x + w) // VIEW_W) + 1):
+                for k, s in self.rooms.get((rx, ry), {}).items():
+                    if s.x < x + w and s.x + s.w > x and s.y < y + h and s.y + s.h > y:
+                        found[k] = s
+        return sorted(found.values(), key=lambda s: self.order[id(s)])
+
+    def clear(self):
+        self.rooms.clear()
+        self.where.clear()
+        self.order.clear()
+        self.count = 0
+
+# Sprite registry
+# A list with O(1) add and removal: each sprite keeps its index in the given slot and removal moves the last sprite into the hole
+class Registry(list):
+    __slots__ = ("pos",)
+
+    def __init__(self, pos):
+        super().__init__()
+        self.pos = pos      # Sprite slot holding its index here
+
+    def add(self, s):
+        setattr(s, self.pos, len(self))
+        self.append(s)
+
+    def discard(self, s):
+        i = getattr(s, self.pos)
+        last = self.pop()
+        if last is not s:
+            self[i] = last
+            setattr(last, self.pos, i)
+
+    def reset(self, sprites=()):
+        self.clear()
+        for s in sprites:
+            self.add(s)
+
+
+# Sprite kinds (collision table keys)
+KIND_NONE = 0
+KIND_LINK = 1
+KIND_TREE = 2
+KIND_CHEST = 3
+KIND_BOOMERANG = 4
+KIND_CUCCO = 5
 
 # Sprite class
+# Sprites use __slots__ (no per-instance __dict__); frames shared by a whole class live on the class
 class Sprite():
+    KIND = KIND_NONE
+    __slots__ = ("x", "y", "w", "h", "valid", "dead", "to_remove", "_img", "_at", "_kind_at")
+
     def __init__(self, x, y, w, h, image_path=None):
         self.x = float(x)
         self.y = float(y)
@@ -52,6 +535,10 @@ class Sprite():
     def update(self):
         return self.valid
 
+    # Position at the start of the tick (sprites that move keep their previous one)
+    def start_pos(self):
+        return self.x, self.y
+
     # Saves sprites to map.json
     def marshal(self):
         return {
@@ -77,8 +564,18 @@ class Sprite():
     def is_cucco(self):
         return False
 
+    # Static sprites never move, so the broadphase only buckets them once
+    def is_static(self):
+        return False
+
+    # Scenery is drawn into the cached room background instead of every frame
+    def is_scenery(self):
+        return False
+
 # Tree class
 class Tree(Sprite):
+    KIND = KIND_TREE
+    __slots__ = ()
     TREE_W = 75     # Tree width
     TREE_H = 100    # Tree height
 
@@ -87,85 +584,121 @@ class Tree(Sprite):
             super().__init__(x, y, w or Tree.TREE_W, h or Tree.TREE_H, SPRITES_DIR + "tree.png")
     def is_tree(self):
         return True
+    def is_static(self):
+        return True
+    def is_scenery(self):
+        return True
 
 # TreasureChest class
 class TreasureChest(Sprite):
+    KIND = KIND_CHEST
     CHEST_W = 71    # Chest width
     CHEST_H = 72    # Chest height
+    rupee_img = None    # Shared rupee image (loaded with the first chest)
+    __slots__ = ("opened", "collectible")
     
     # Loads TreasureChest
     def __init__(self, x, y, w=None, h=None):
         super().__init__(x, y, w or TreasureChest.CHEST_W, h or TreasureChest.CHEST_H, SPRITES_DIR + "treasurechest.png")
                          
-        self.opened = False     # Draws chest if false (Draws rupee if true)
-        self.timer = 0          # Counts frames if opened
-        self._rupee_img = load_image(SPRITES_DIR + "rupee.png")
+        self.opened = False         # Draws chest if false (Draws rupee if true)
+        self.collectible = False    # Set by the timer wheel once the rupee delay passes
+        if TreasureChest.rupee_img is None:
+            TreasureChest.rupee_img = load_image(SPRITES_DIR + "rupee.png")
     
     def is_chest(self):
         return True
+    def is_static(self):
+        return True
+    def is_scenery(self):
+        return not self.opened
     def is_item(self):
         return not self.opened
     
-    # Timer starts once chest is opened (rupee appears)
-    def open(self):
+    # Rupee appears once chest is opened
+    # The timer wheel makes it collectible after RUPEE_DELAY and expires it after RUPEE_TTL more ticks
+    # (expired is the model's list of chests to take out of the world)
+    def open(self, timers, expired):
         if not self.opened:
             self.opened = True
-            self.timer = 0
+            self.collectible = False
+            timers.schedule(RUPEE_DELAY, self._ready)
+            timers.schedule(RUPEE_DELAY + RUPEE_TTL + 1, lambda: self.expire(expired))
+
+    def _ready(self):
+        self.collectible = True
+
+    def expire(self, expired):
+        if not self.dead:
+            self.dead = True
+            expired.append(self)
     
     # Returns true once rupee delay passes
     def can_collect(self):
-        return self.opened and self.timer >= RUPEE_DELAY
+        return self.opened and self.collectible
     
-    def collect(self):
-        self.timer = RUPEE_DELAY + RUPEE_TTL + 1
-
-    # Update method (counts down rupee lifetime)
-    def update(self):
-        if self.opened:
-            self.timer += 1
-            if self.timer > RUPEE_DELAY + RUPEE_TTL:
-                self.dead = True
-        return True
+    # Rupee goes away next tick
+    def collect(self, timers, expired):
+        timers.schedule(1, lambda: self.expire(expired))
     
     # Draws either rupee or chest depending on state
     def get_draw_image(self):
-        return self._rupee_img if self.opened else super().get_draw_image()
+        return self.rupee_img if self.opened else super().get_draw_image()
 
 # Boomerang Class
 class Boomerang(Sprite):
+    KIND = KIND_BOOMERANG
+    frames = None       # Shared spin frames (loaded with the first boomerang)
+    __slots__ = ("animate", "vx", "vy", "px", "py")
+
+    # Velocity for each facing direction (anything else throws downward)
+    VELOCITY = {
+        "left": (-BOOMERANG_SPEED, 0),
+        "right": (BOOMERANG_SPEED, 0),
+        "up": (0, -BOOMERANG_SPEED),
+        "down": (0, BOOMERANG_SPEED)
+    }
+
     def __init__(self, cx, cy, direction):
         super().__init__(cx, cy, 24, 24, None)
-        self.frames = [load_image(SPRITES_DIR + f"boomerang{i}.png") for i in range(1, 5)]
-        self.animate = 0
+        if Boomerang.frames is None:
+            Boomerang.frames = [load_image(SPRITES_DIR + f"boomerang{i}.png") for i in range(1, 5)]
+        self.reset(cx, cy, direction)
 
+    # Puts a pooled boomerang back in flight
+    def reset(self, cx, cy, direction):
         # Shoots from the center of Link
-        self.x -= self.w / 2
-        self.y -= self.h / 2
-
-        # Handles Velocity
-        if direction == "left":
-            self.vx = -BOOMERANG_SPEED
-            self.vy = 0
-        elif direction == "right":
-            self.vx = BOOMERANG_SPEED
-            self.vy = 0
-        elif direction == "up":
-            self.vx = 0
-            self.vy = -BOOMERANG_SPEED
-        else:
-            self.vx = 0
-            self.vy = BOOMERANG_SPEED
+        self.x = cx - self.w / 2
+        self.y = cy - self.h / 2
+        self.vx, self.vy = self.VELOCITY.get(direction, self.VELOCITY["down"])
+        self.px = self.x
+        self.py = self.y
+        self.animate = 0
+        self.valid = True
+        self.dead = False
+        self.to_remove = False
     
     def is_boomerang(self):
         return True
-    def kill(self):
+
+    # Dies where its path first touched ob this tick (the rest of the move is undone)
+    def kill(self, ob=None):
         self.dead = True
+        hit = sweep_aabb(self, ob) if ob is not None else None
+        if hit is not None:
+            self.x = self.px + (self.x - self.px) * hit[0]
+            self.y = self.py + (self.y - self.py) * hit[0]
+
+    def start_pos(self):
+        return self.px, self.py
 
     # Update Method
     def update(self):
         if self.dead:
             self.to_remove = True
             return False
+        self.px = self.x
+        self.py = self.y
         self.x += self.vx
         self.y += self.vy
         self.animate += 1
@@ -181,10 +714,43 @@ class Boomerang(Sprite):
             return self.frames[(self.animate // 3) % len(self.frames)]
         return super().get_draw_image()
     
+# Boomerang pool
+# Every boomerang is made up front; throwing takes a free one and expiring hands it back
+class BoomerangPool():
+    def __init__(self, capacity=BOOMERANG_POOL):
+        self.capacity = capacity
+        self.free = [Boomerang(0, 0, "down") for _ in range(capacity)]
+        self.in_use = 0
+        self.high_water = 0     # Most boomerangs in flight at once
+        self.refused = 0        # Throws dropped because the pool was empty
+
+    # Returns a boomerang ready to fly, or None when all of them are out
+    def acquire(self, cx, cy, direction):
+        if not self.free:
+            self.refused += 1
+            return None
+        b = self.free.pop()
+        b.reset(cx, cy, direction)
+        self.in_use += 1
+        if self.in_use > self.high_water:
+            self.high_water = self.in_use
+        return b
+
+    def release(self, b):
+        self.free.append(b)
+        self.in_use -= 1
+
 # Link class
 class Link(Sprite):
+    KIND = KIND_LINK
     LINK_W = 48     # Link width
     LINK_H = 48     # Link height
+    frames = None   # Shared walking frames (loaded with the first Link)
+
+    # Cycles Link's frame based on direction (11 frames per direction)
+    dirBase = {"down": 0, "left": 11, "right": 22, "up": 33}
+
+    __slots__ = ("px", "py", "dx", "dy", "direction", "moving", "frame", "frameDelay", "frameCounter")
 
     # Load Link
     def __init__(self, x, y):
@@ -201,14 +767,12 @@ class Link(Sprite):
         # Handles animation
         self.direction = "down"
         self.moving = False
-        self.frames = [load_image(SPRITES_DIR + f"link{i}.png") for i in range(1, 45)]
+        if Link.frames is None:
+            Link.frames = [load_image(SPRITES_DIR + f"link{i}.png") for i in range(1, 45)]
         self.frame = 0
         self.frameDelay = 1
         self.frameCounter = 0
 
-        # Cycles Link's frame based on direction (11 frames per direction)
-        self.dirBase = {"down": 0, "left": 11, "right": 22, "up": 33}
-
     def is_link(self):
         return True
     
@@ -231,16 +795,22 @@ class Link(Sprite):
         self.px = self.x
         self.py = self.y
 
+    def start_pos(self):
+        return self.px, self.py
+
     # Pushes Link back to object depending on which side he entered from
-    # Previous position is used to help determine which side
+    # The side is the one his path crossed first (a diagonal step into a corner slides along the face it hit)
     def push_back(self, ob):
-        if self.py + self.h <= ob.y:
+        side = contact_side(self, ob)
+        if side is None:
+            return
+        if side == "top":
             self.y = ob.y - self.h      # from above
-        elif self.py >= ob.y + ob.h:
+        elif side == "bottom":
             self.y = ob.y + ob.h        # from below
-        elif self.px + self.w <= ob.x:
+        elif side == "left":
             self.x = ob.x - self.w      # from left
-        elif self.px >= ob.x + ob.w:
+        else:
             self.x = ob.x + ob.w        # from right
 
     # Update method
@@ -275,69 +845,86 @@ class Link(Sprite):
             return self.frames[base + self.frame]
         return super().get_draw_image()
 
+# Flock mood
+# What every cucco in one world shares (each Model has its own, so worlds can run side by side)
+class FlockMood():
+    def __init__(self):
+        self.linkx = 0.0        # Link center x
+        self.linky = 0.0        # Link center y
+        self.reset()
+
+    # Calm flock, no cuccos counted
+    def reset(self):
+        self.count = 0          # Number of cuccos
+        self.hits = 0           # Number of hits from either Link or the boomerangs
+        self.angry = False      # angry flag
+        self.disappeared = 0    # Number of cuccos that disappeared
+        self.angered = 0        # Times the flock turned angry
+
 # Cucco Class
 class Cucco(Sprite):
-    COUNT = 0           # Number of cuccos
-    HITS = 0            # Number of hits from either Link or the boomerangs
-    ANGRY = False       # angry flag
-    DISAPPEARED = 0     # Number of cuccos that disappeared    
-    linkx = 0.0         # Link center x
-    linky = 0.0         # Link center y
-
+    KIND = KIND_CUCCO
     CUCCO_W = 40        # Cucco width
     CUCCO_H = 32        # Cucco height
+    PECK_TIME = 20      # Ticks an attached cucco stays on Link
+    ROAM_SPEED = 2.0    # Pixels per tick when calm
+    ANGRY_SPEED = 5.0   # Pixels per tick when chasing Link
 
-    # Resets flock state
-    @staticmethod
-    def reset():
-        Cucco.COUNT = 0
-        Cucco.HITS = 0
-        Cucco.ANGRY = False
-        Cucco.DISAPPEARED = 0
+    # Images drawn based on Cucco's mood (shared, loaded with the first cucco)
+    images_left = None
+    images_right = None
+    angry_left = None
+    angry_right = None
 
-    # Draws Cucco
-    def __init__(self, x, y):
+    __slots__ = ("mood", "roam_speed", "xdir", "ydir", "angry_speed", "attached", "animate", "facing_right", "px", "py", "lod_tick")
+
+    # Draws Cucco (mood is its world's FlockMood, starting direction comes from rng, the model's seeded one in game)
+    def __init__(self, x, y, mood, rng=random):
         super().__init__(x, y, Cucco.CUCCO_W, Cucco.CUCCO_H, None)
-        Cucco.COUNT += 1
+        self.mood = mood
+        mood.count += 1
 
         # Handles movement when Cucco is not angry
-        self.roam_speed = 2.0
-        self.xdir = random.choice([-1, 1])
-        self.ydir = random.choice([-1, 1])
+        self.roam_speed = Cucco.ROAM_SPEED
+        self.xdir = rng.choice([-1, 1])
+        self.ydir = rng.choice([-1, 1])
         
         # Handles movement when Cucco is angry
-        self.angry_speed = 5.0
+        self.angry_speed = Cucco.ANGRY_SPEED
         self.attached = False
-        self.attach_timer = 0
 
         # Handles animation
         self.animate = 0
         self.facing_right = True
 
         # Images drawn based on Cucco's mood
-        self.images_left = [
-            load_image(SPRITES_DIR + "cucco1.png"),
-            load_image(SPRITES_DIR + "cucco2.png")
-        ]
-
-        self.images_right = [
-            load_image(SPRITES_DIR + "cucco3.png"),
-            load_image(SPRITES_DIR + "cucco4.png")
-        ]
-
-        self.angry_left = [
-            load_image(SPRITES_DIR + "angrycucco1.png"),
-            load_image(SPRITES_DIR + "angrycucco2.png")
-        ]
-
-        self.angry_right = [
-            load_image(SPRITES_DIR + "angrycucco3.png"), 
-            load_image(SPRITES_DIR + "angrycucco4.png")
-        ]
+        if Cucco.images_left is None:
+            Cucco.images_left = [
+                load_image(SPRITES_DIR + "cucco1.png"),
+                load_image(SPRITES_DIR + "cucco2.png")
+            ]
+
+            Cucco.images_right = [
+                load_image(SPRITES_DIR + "cucco3.png"),
+                load_image(SPRITES_DIR + "cucco4.png")
+            ]
+
+            Cucco.angry_left = [
+                load_image(SPRITES_DIR + "angrycucco1.png"),
+                load_image(SPRITES_DIR + "angrycucco2.png")
+            ]
+
+            Cucco.angry_right = [
+                load_image(SPRITES_DIR + "angrycucco3.png"), 
+                load_image(SPRITES_DIR + "angrycucco4.png")
+            ]
 
         # Bounce side resolution
         self.px = self.x
         self.py = self.y
+
+        # Tick this cucco last moved on (far from Link it moves several ticks at once)
+        self.lod_tick = None
     
     def is_cucco(self):
         return True
@@ -346,69 +933,73 @@ class Cucco(Sprite):
         self.px = self.x
         self.py = self.y
 
+    def start_pos(self):
+        return self.px, self.py
+
     # Hit counter (Flock becomes angry if hit >= 5 times and more than one cucco is alive)
     def is_hit(self):
-        Cucco.HITS += 1
-        if Cucco.HITS >= 5 and Cucco.COUNT > 1:
-            Cucco.ANGRY = True
+        mood = self.mood
+        mood.hits += 1
+        if mood.hits >= 5 and mood.count > 1 and not mood.angry:
+            mood.angry = True
+            mood.angered += 1
     
     # Resolves bouncing off an item (only when not angry)
     def _bounce_from_item(self, ob):
-        if self.py + self.h <= ob.y:
+        side = contact_side(self, ob)
+        if side is None:
+            return
+        if side == "top":
             #from above
             self.y = ob.y - self.h
             self.ydir *= -1
-        elif self.py >= ob.y + ob.h:
+        elif side == "bottom":
             # from below
             self.y = ob.y + ob.h
             self.ydir *= -1
-        elif self.px + self.w <= ob.x:
+        elif side == "left":
             # from left
             self.x = ob.x - self.w
             self.xdir *= -1
-        elif self.px >= ob.x + ob.w:
+        else:
             # from right
             self.x = ob.x + ob.w
             self.xdir *= -1
     
-    # Update method
-    def update(self, link=None):
+    # Update method (dt is the number of ticks to move at once)
+    def update(self, link=None, dt=1):
         self.begin_frame()
-        self.animate += 1
+        self.animate += dt
     
         # Calms the flock
-        if Cucco.COUNT <= 1 or Cucco.DISAPPEARED >= 3:
-            Cucco.ANGRY = False
-            Cucco.HITS = 0
-            Cucco.DISAPPEARED = 0
+        mood = self.mood
+        if mood.count <= 1 or mood.disappeared >= 3:
+            mood.angry = False
+            mood.hits = 0
+            mood.disappeared = 0
         
-        # Cucco stays attached to Link until timer runs out
+        # Cucco stays attached to Link until the timer wheel makes it disappear
         if self.attached:
             if link:
                 self.x = link.x + link.w/2 - self.w/2
                 self.y = link.y + link.h/2 - self.h/2
-            self.attach_timer -= 1
-            if self.attach_timer <= 0:
-                self.to_remove = True
-                Cucco.COUNT = max(0, Cucco.COUNT - 1)
-                Cucco.DISAPPEARED += 1
             return True
         
         # Cucco flues towards Link if angry
-        if Cucco.ANGRY and link is not None:
-            dx = (Cucco.linkx - self.x)
-            dy = (Cucco.linky - self.y)
-            dist = math.hypot(dx, dy)
+        if mood.angry and link is not None:
+            dx = (mood.linkx - self.x)
+            dy = (mood.linky - self.y)
+            dist = math.sqrt(dx * dx + dy * dy)    # Not hypot: sqrt rounds the same in NumPy, so both engines agree bit for bit
             if dist < 0.001:
                 dist = 0.001
-            self.x += (dx / dist) * self.angry_speed
-            self.y += (dy / dist) * self.angry_speed
+            self.x += (dx / dist) * self.angry_speed * dt
+            self.y += (dy / dist) * self.angry_speed * dt
             self.facing_right = dx >= 0
         
         # Cucco simply roams 
         else:
-            self.x += self.xdir * self.roam_speed
-            self.y += self.ydir * self.roam_speed
+            self.x += self.xdir * self.roam_speed * dt
+            self.y += self.ydir * self.roam_speed * dt
             self.facing_right = (self.xdir > 0)
 
             if self.x < 0:
@@ -418,43 +1009,566 @@ class Cucco(Sprite):
             if self.y < 0:
                 self.y = 0; self.ydir = +1
             if self.y + self.h > WORLD_H:
-                self.y = WORLD_H - self.h; self.ydi = -1
+                self.y = WORLD_H - self.h; self.ydir = -1
         
         return True
     
-    # Triggers pecking for 20 frames
-    def attach_to_link(self):
+    # Triggers pecking for PECK_TIME frames
+    def attach_to_link(self, timers):
         if not self.attached:
             self.attached = True
-            self.attach_timer = 20
+            timers.schedule(Cucco.PECK_TIME, self.disappear)
+
+    # Does nothing for a cucco that left the world (deleted or unloaded) before its peck timer ran out
+    def disappear(self):
+        if self.dead:
+            return
+        self.to_remove = True
+        self.mood.count = max(0, self.mood.count - 1)
+        self.mood.disappeared += 1
         
     # Draws cucco based on mood
     def get_draw_image(self):
         idx = (self.animate // 8) % 2
-        if Cucco.ANGRY or self.attached:
+        if self.mood.angry or self.attached:
             return self.angry_right[idx] if self.facing_right else self.angry_left[idx]
         else:
             return self.images_right[idx] if self.facing_right else self.images_left[idx]
 
+# Flock engine
+# Keeps every cucco's movement state in NumPy arrays and moves the whole flock at once
+# Cuccos made by spawn() are FlockCuccos that read and write their slot in the arrays
+class Flock():
+    FIELDS = {
+        "x": "f8", "y": "f8", "px": "f8", "py": "f8",
+        "xdir": "i8", "ydir": "i8", "roam_speed": "f8", "angry_speed": "f8",
+        "attached": "?", "animate": "i8",
+        "facing_right": "?", "to_remove": "?", "live": "?"
+    }
+
+    def __init__(self, mood, capacity=64):
+        if np is None:
+            raise RuntimeError("The flock engine needs numpy")
+        self.mood = mood
+        self.n = 0              # Slots in use
+        self.views = []         # slot -> FlockCucco
+        for name, dtype in Flock.FIELDS.items():
+            setattr(self, name, np.zeros(capacity, dtype))
+
+    def spawn(self, x, y, rng=random):
+        return FlockCucco(self, x, y, rng)
+
+    def _alloc(self, view):
+        if self.n == len(self.x):
+            for name in Flock.FIELDS:
+                old = getattr(self, name)
+                arr = np.zeros(2 * len(old), old.dtype)
+                arr[:self.n] = old[:self.n]
+                setattr(self, name, arr)
+        slot = self.n
+        self.n += 1
+        for name in Flock.FIELDS:
+            getattr(self, name)[slot] = 0
+        self.live[slot] = True
+        self.views.append(view)
+        return slot
+
+    # Frees a slot by moving the last cucco into it (the model's cucco registry does the same, so update order matches)
+    def remove(self, c):
+        i = c._slot
+        if i >= self.n or self.views[i] is not c:
+            return
+        last = self.n - 1
+        if i != last:
+            for name in Flock.FIELDS:
+                arr = getattr(self, name)
+                arr[i] = arr[last]
+            self.views[i] = self.views[last]
+            self.views[i]._slot = i
+        for name in Flock.FIELDS:
+            getattr(self, name)[last] = 0
+        self.views.pop()
+        self.n = last
+
+    def clear(self):
+        self.live[:self.n] = False
+        self.n = 0
+        self.views = []
+
+    # Same as calling Cucco.update(link) on every cucco, back to front like Model.update_sprites walks Model.cuccos
+    def step(self, link):
+        order = np.flatnonzero(self.live[:self.n])[::-1]
+        if len(order) == 0:
+            return
+        self.px[order] = self.x[order]
+        self.py[order] = self.y[order]
+        self.animate[order] += 1
+
+        # Calms the flock
+        mood = self.mood
+        if mood.count <= 1 or mood.disappeared >= 3:
+            mood.angry = False
+            mood.hits = 0
+            mood.disappeared = 0
+
+        # Attached cuccos follow Link
+        att = self.attached[order]
+        held = order[att]
+        self.x[held] = link.x + link.w/2 - Cucco.CUCCO_W/2
+        self.y[held] = link.y + link.h/2 - Cucco.CUCCO_H/2
+
+        # Angry cuccos fly towards Link
+        chasing = mood.angry
+        chase = order[~att] if chasing else order[:0]
+        dx = mood.linkx - self.x[chase]
+        dy = mood.linky - self.y[chase]
+        dist = np.maximum(np.sqrt(dx * dx + dy * dy), 0.001)
+        self.x[chase] += (dx / dist) * self.angry_speed[chase]
+        self.y[chase] += (dy / dist) * self.angry_speed[chase]
+        self.facing_right[chase] = dx >= 0
+
+        # The rest roam and bounce off the world edges
+        roam = order[:0] if chasing else order[~att]
+        self.x[roam] += self.xdir[roam] * self.roam_speed[roam]
+        self.y[roam] += self.ydir[roam] * self.roam_speed[roam]
+        self.facing_right[roam] = self.xdir[roam] > 0
+        x = self.x[roam]
+        y = self.y[roam]
+        xdir = self.xdir[roam]
+        ydir = self.ydir[roam]
+        edge = x < 0
+        x[edge] = 0; xdir[edge] = 1
+        edge = x + Cucco.CUCCO_W > WORLD_W
+        x[edge] = WORLD_W - Cucco.CUCCO_W; xdir[edge] = -1
+        edge = y < 0
+        y[edge] = 0; ydir[edge] = 1
+        edge = y + Cucco.CUCCO_H > WORLD_H
+        y[edge] = WORLD_H - Cucco.CUCCO_H; ydir[edge] = -1
+        self.x[roam] = x
+        self.y[roam] = y
+        self.xdir[roam] = xdir
+        self.ydir[roam] = ydir
+
+# Attribute stored in the flock arrays
+def _flock_field(name):
+    def get(self):
+        return getattr(self._flock, name).item(self._slot)
+    def set(self, value):
+        getattr(self._flock, name)[self._slot] = value
+    return property(get, set)
+
+# Cucco whose movement state lives in a Flock
+class FlockCucco(Cucco):
+    __slots__ = ("_flock", "_slot")
+
+    def __init__(self, flock, x, y, rng=random):
+        self._flock = flock
+        self._slot = flock._alloc(self)
+        super().__init__(x, y, flock.mood, rng)
+
+    # Moved by Flock.step instead
+    def update(self, link=None, dt=1):
+        return True
+
+for _name in Flock.FIELDS:
+    if _name != "live":
+        setattr(FlockCucco, _name, _flock_field(_name))
+
+# Permissions mask for new files (read once here: setting it is process-wide, so the saver thread can't)
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+# Writes JSON to a temp file next to path, then renames it over path
+# A crash mid-write leaves the old file in place
+def write_json_atomic(path, data):
+    _write_atomic(path, "w", lambda f: json.dump(data, f))
+
+# Writes map.json-format data in the format already at path (binary or JSON), or by extension for a new file
+def write_map_atomic(path, data, binary=None):
+    if binary is None:
+        binary = is_binary_map(path) if os.path.exists(path) else path.endswith(MAP_BINARY_EXT)
+    if binary:
+        _write_atomic(path, "wb", lambda f: f.write(pack_map(data)))
+    else:
+        write_json_atomic(path, data)
+
+# The new file keeps the old one's permissions (a new file gets the usual ones, mkstemp alone would leave it 0600)
+def _write_atomic(path, mode, write):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            perms = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            perms = 0o666 & ~UMASK
+        os.chmod(tmp, perms)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+# Background saver
+# One worker thread runs save jobs in the order they were queued
+# Files still waiting to be written are kept in pending so reads see the newest data
+class SaveWorker():
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+        self.pending = {}       # path -> data waiting to be written (None = waiting to be deleted)
+        self.last = None        # Future of the last queued job
+
+    def submit(self, fn, *args):
+        self.last = self.pool.submit(fn, *args)
+        return self.last
+
+    def write_json(self, path, data):
+        with self.lock:
+            self.pending[path] = data
+        return self.submit(self._write, path, data)
+
+    def remove(self, path):
+        with self.lock:
+            self.pending[path] = None
+        return self.submit(self._write, path, None)
+
+    def _write(self, path, data):
+        try:
+            if data is not None:
+                write_json_atomic(path, data)
+            elif os.path.exists(path):
+                os.remove(path)
+        finally:
+            with self.lock:
+                if self.pending.get(path, 0) is data:
+                    del self.pending[path]
+
+    # Blocks until every queued job has finished
+    def wait(self):
+        if self.last is not None:
+            self.submit(lambda: None).result()
+
+# Chunked map
+# A map folder holds index.json (world size and Link's position) and one r{x}_{y}.json per
+# non-empty room with the trees, chests and cuccos whose top-left corner is in that room
+class ChunkStore():
+    VERSION = 1
+
+    def __init__(self, path, saver=None):
+        self.path = path
+        self.saver = saver      # Writes go through the background saver when there is one
+
+    def _chunk_path(self, rx, ry):
+        return os.path.join(self.path, f"r{rx}_{ry}.json")
+
+    def read_index(self):
+        with open(os.path.join(self.path, "index.json")) as f:
+            return json.load(f)
+
+    def write_index(self, linkx, linky):
+        os.makedirs(self.path, exist_ok=True)
+        data = {
+            "version": ChunkStore.VERSION,
+            "world_w": WORLD_W,
+            "world_h": WORLD_H,
+            "chunk_w": VIEW_W,
+            "chunk_h": VIEW_H,
+            "linkx": linkx,
+            "linky": linky
+        }
+        self._write(os.path.join(self.path, "index.json"), data)
+
+    # Missing rooms are empty
+    def read(self, rx, ry):
+        path = self._chunk_path(rx, ry)
+        if self.saver is not None:
+            with self.saver.lock:
+                if path in self.saver.pending:
+                    data = self.saver.pending[path]
+                    return json.loads(json.dumps(data)) if data is not None else {"trees": [], "chests": [], "cuccos": []}
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"trees": [], "chests": [], "cuccos": []}
+
+    def write(self, rx, ry, data):
+        path = self._chunk_path(rx, ry)
+        if not (data["trees"] or data["chests"] or data["cuccos"]):
+            if self.saver is not None:
+                self.saver.remove(path)
+            elif os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(self.path, exist_ok=True)
+        self._write(path, data)
+
+    def _write(self, path, data):
+        if self.saver is not None:
+            self.saver.write_json(path, data)
+        else:
+            write_json_atomic(path, data)
+
+    # Writes a whole map (save_map's dict format), replacing any rooms already in the folder
+    def write_world(self, data):
+        rooms = {}
+        for kind in ("trees", "chests", "cuccos"):
+            for e in data.get(kind, []):
+                room = rooms.setdefault((int(e["x"] // VIEW_W), int(e["y"] // VIEW_H)), {"trees": [], "chests": [], "cuccos": []})
+                room[kind].append(e)
+        for path in glob.glob(os.path.join(self.path, "r*_*.json")):
+            os.remove(path)
+        for (rx, ry), room in rooms.items():
+            self.write(rx, ry, room)
+        self.write_index(data.get("linkx", 200), data.get("linky", 300))
+
+# Reads a map file, JSON or binary (None when there isn't one)
+def read_map(path):
+    try:
+        if is_binary_map(path):
+            with MapFile(path) as mf:
+                return mf.to_data()
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+# Converts a map file between JSON (.json), binary (.lkm) and a chunked map folder (anything else, optionally with a bigger world)
+def convert_map(src, dst, world_w=None, world_h=None):
+    data = read_map(src)
+    if data is None:
+        raise FileNotFoundError(src)
+    if dst.endswith(".json") or dst.endswith(MAP_BINARY_EXT):
+        write_map_atomic(dst, data, binary=dst.endswith(MAP_BINARY_EXT))
+        return
+    if world_w and world_h:
+        set_world_size(world_w, world_h)
+    ChunkStore(dst).write_world(data)
+
+# Binary map
+# A header (magic, version, header size, a record type for Link and each table, Link's position, table lengths)
+# followed by the tree, chest and cucco tables, each a packed run of x, y pairs, all little-endian
+# Record types: i = int32, q = int64, d = float64, - = no Link position
+# Positions keep their values and int/float types, so JSON -> binary -> JSON gives back the same map
+# (a table mixing ints and floats is stored as floats)
+MAP_MAGIC = b"LKMP"
+MAP_VERSION = 1
+MAP_HEADER = struct.Struct("<4sHH4sddIII")
+MAP_TABLES = ("trees", "chests", "cuccos")
+
+def is_binary_map(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAP_MAGIC)) == MAP_MAGIC
+    except (FileNotFoundError, IsADirectoryError):
+        return False
+
+def _record_type(values):
+    if all(type(v) is int for v in values):
+        return "i" if all(-2 ** 31 <= v < 2 ** 31 for v in values) else "q"
+    return "d"
+
+# Packs map.json-format data into a binary map
+def pack_map(data):
+    link = (data["linkx"], data["linky"]) if "linkx" in data else None
+    codes = _record_type(link) if link else "-"
+    tables = []
+    for kind in MAP_TABLES:
+        coords = [v for e in data.get(kind, []) for v in (e["x"], e["y"])]
+        code = _record_type(coords)
+        codes += code
+        table = array(code, coords)
+        if sys.byteorder == "big":
+            table.byteswap()
+        tables.append(table.tobytes())
+    counts = [len(data.get(kind, [])) for kind in MAP_TABLES]
+    header = MAP_HEADER.pack(MAP_MAGIC, MAP_VERSION, MAP_HEADER.size, codes.encode(), *(link or (0, 0)), *counts)
+    return header + b"".join(tables)
+
+# Memory-mapped binary map
+# Tables are read straight out of the mapping through memoryview casts, so loading builds no dict per entity
+class MapFile():
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, size, codes, lx, ly, *counts = MAP_HEADER.unpack_from(self.mm)
+            if magic != MAP_MAGIC or version > MAP_VERSION:
+                raise ValueError(f"{path}: not a version {MAP_VERSION} binary map")
+            codes = codes.decode()
+            self.link = None if codes[0] == "-" else (lx, ly) if codes[0] == "d" else (int(lx), int(ly))
+            self.tables = {}        # kind -> (start, end, record type, count)
+            start = size
+            for kind, code, n in zip(MAP_TABLES, codes[1:], counts):
+                end = start + 2 * n * array(code).itemsize
+                self.tables[kind] = (start, end, code, n)
+                start = end
+            if start > len(self.mm):
+                raise ValueError(f"{path}: truncated binary map")
+        except (struct.error, ValueError):
+            self.mm.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.mm.close()
+
+    def count(self, kind):
+        return self.tables[kind][3]
+
+    # x, y pairs of one table (the views are released once the pairs run out)
+    def positions(self, kind):
+        start, end, code, n = self.tables[kind]
+        raw = memoryview(self.mm)[start:end]
+        table = raw.cast(code) if sys.byteorder == "little" else _swapped(raw, code)
+        xs, ys = table[0::2], table[1::2]
+        try:
+            yield from zip(xs, ys)
+        finally:
+            for v in (xs, ys, table, raw):
+                if isinstance(v, memoryview):
+                    v.release()
+
+    # The whole map in map.json format
+    def to_data(self):
+        data = {kind: [{"x": x, "y": y} for x, y in self.positions(kind)] for kind in MAP_TABLES}
+        if self.link is not None:
+            data["linkx"], data["linky"] = self.link
+        return data
+
+def _swapped(raw, code):
+    table = array(code, raw.tobytes())
+    table.byteswap()
+    return table
+
+# Per-tick speeds and tick counts as tuned for TUNED_TICK_RATE
+TUNED = {
+    "LINK_SPEED": LINK_SPEED,
+    "BOOMERANG_SPEED": BOOMERANG_SPEED,
+    "RUPEE_DELAY": RUPEE_DELAY,
+    "RUPEE_TTL": RUPEE_TTL,
+    "AUTOSAVE_TICKS": AUTOSAVE_TICKS,
+    "PECK_TIME": Cucco.PECK_TIME,
+    "ROAM_SPEED": Cucco.ROAM_SPEED,
+    "ANGRY_SPEED": Cucco.ANGRY_SPEED
+}
+
+# Changes the simulation tick rate (call before building a Model)
+# Speeds shrink and durations in ticks grow with the rate, so the game plays at the same speed in real time
+def set_tick_rate(rate):
+    global TICK_RATE, LINK_SPEED, BOOMERANG_SPEED, RUPEE_DELAY, RUPEE_TTL, AUTOSAVE_TICKS
+    TICK_RATE = rate
+    per_tick = TUNED_TICK_RATE / rate
+    ticks = lambda name: max(1, round(TUNED[name] / per_tick))
+    LINK_SPEED = TUNED["LINK_SPEED"] * per_tick
+    BOOMERANG_SPEED = TUNED["BOOMERANG_SPEED"] * per_tick
+    RUPEE_DELAY = ticks("RUPEE_DELAY")
+    RUPEE_TTL = ticks("RUPEE_TTL")
+    AUTOSAVE_TICKS = ticks("AUTOSAVE_TICKS")
+    Cucco.PECK_TIME = ticks("PECK_TIME")
+    Cucco.ROAM_SPEED = TUNED["ROAM_SPEED"] * per_tick
+    Cucco.ANGRY_SPEED = TUNED["ANGRY_SPEED"] * per_tick
+    Boomerang.VELOCITY = {
+        "left": (-BOOMERANG_SPEED, 0),
+        "right": (BOOMERANG_SPEED, 0),
+        "up": (0, -BOOMERANG_SPEED),
+        "down": (0, BOOMERANG_SPEED)
+    }
+
+# Input recording
+# Everything that changes the world from outside (Link's input, throws, edits, map loads), stamped with the tick it came before
+# Replaying it from the same seed and starting map gives the same world tick for tick
+class Recording():
+    def __init__(self, seed, data):
+        self.seed = seed
+        self.tick_rate = TICK_RATE
+        self.map = data         # Starting world in map.json format
+        self.events = []        # [tick, op, args...]
+        self.ticks = 0
+        self.hash = None        # Model.state_hash() at the end
+
+    def add(self, *event):
+        self.events.append([self.ticks, *event])
+
+    def save(self, path):
+        write_json_atomic(path, {
+            "seed": self.seed,
+            "tick_rate": self.tick_rate,
+            "map": self.map,
+            "ticks": self.ticks,
+            "hash": self.hash,
+            "events": self.events
+        })
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            data = json.load(f)
+        rec = Recording(data["seed"], data["map"])
+        rec.ticks = data["ticks"]
+        rec.tick_rate = data.get("tick_rate", TUNED_TICK_RATE)
+        rec.hash = data.get("hash")
+        rec.events = data["events"]
+        return rec
+
 # Model Class
 class Model():
     filename = "map.json"
     
-    def __init__(self):
-        self.sprites = []
+    # data is the already parsed map.json (read from filename when None)
+    # filename is this world's map file or folder (Model.filename when None)
+    def __init__(self, flock=USE_FLOCK_ENGINE, seed=None, data=None, filename=None):
+        self.filename = filename if filename is not None else Model.filename
+
+        # Seeded RNG for everything random in the world (cucco directions)
+        self.seed = seed if seed is not None else random.randrange(1 << 32)
+        self.rng = random.Random(self.seed)
+
+        # Every sprite (iteration order for collisions) and one registry per type
+        self.sprites = Registry("_at")
+        self.trees = Registry("_kind_at")
+        self.chests = Registry("_kind_at")
+        self.cuccos = Registry("_kind_at")
+        self.projectiles = Registry("_kind_at")
+        self.by_kind = {
+            KIND_TREE: self.trees,
+            KIND_CHEST: self.chests,
+            KIND_CUCCO: self.cuccos,
+            KIND_BOOMERANG: self.projectiles
+        }
         self.link = Link(200, 300)
-        self.sprites.append(self.link)
+        self.sprites.add(self.link)
 
         # Camera position
         self.camX = 0
         self.camY = 0
+        self.roomX = 0
+        self.roomY = 0
 
         # HUD counter
         self.rupees = 0
 
         # Edit mode
+        self.edit_mode = False
         self.items = ["Tree", "Chest", "Cucco"]
         self.add_type = "Tree"
+
+        # Brush strokes, rectangle selection and batched edits
+        self.brush_spacing = BRUSH_SPACING
+        self.brush_overlap = BRUSH_OVERLAP
+        self.stroke_last = None     # Where the current stroke last placed an item (None between strokes)
+        self.selection = []
+        self.select_box = None      # World rect being dragged out (drawn by the view)
+        self.batch_rect = None      # Bounds of the scenery changed by the open batch (None when no batch is open)
+        self.batch_depth = 0
         
         # Shows sprites in edit-box
         self.sprite = {
@@ -463,233 +1577,947 @@ class Model():
             "Cucco": load_image(SPRITES_DIR + "cucco3.png")
         }
 
+        # Collision broadphase (trees and chests are bucketed once when added)
+        self.broadphase = USE_BROADPHASE
+        self.continuous = USE_SWEPT
+        self.static_grid = SpatialHash()
+
+        # Room lookup for drawing (kept up to date as sprites move)
+        self.room_index = RoomIndex()
+        self.room_index.update(self.link)
+
+        # Scenery changes the view has not redrawn yet (map_version bumps on a full reload)
+        # None until a view is attached, so headless runs don't collect them
+        self.dirty_rects = None
+        self.map_version = 0
+
+        # Cucco counters and anger shared by this world's flock
+        self.mood = FlockMood()
+
+        # Optional NumPy flock engine
+        self.flock = Flock(self.mood) if flock else None
+
+        # Rupee and pecking timers (expired holds chests whose rupee timed out this tick)
+        self.timers = TimerWheel()
+        self.expired = []
+
+        # Reused boomerangs (throws past capacity are dropped)
+        self.boomerangs = BoomerangPool()
+
+        # Chunked map streaming (only used when filename is a map folder)
+        self.store = None
+        self.loaded_chunks = set()
+        self.dirty_chunks = set()
+        self.stream_room = None
+
+        # Background saving and the autosave journal (edits since the last full save)
+        self.saver = SaveWorker()
+        self.autosave = AUTOSAVE
+        self.journal = []           # Entries not written yet
+        self.journal_size = 0       # Entries in the journal file
+        self.replaying = False
+
+        # Simulation level of detail (cucco updates per tier: rooms around Link, everywhere else)
+        self.lod = USE_LOD
+        self.lod_cursor = 0
+        self.lod_last = (0, 0)      # Last tick
+        self.lod_ticks = [0, 0]     # Since the model was made
+        self.active_cuccos = self.cuccos
+
+        # Input recording (None when off)
+        self.recording = None
+
+        # Frame profiler (None when off) and the last tick's collision counts
+        self.profiler = None
+        self.pairs_tested = 0
+        self.pairs_hit = 0
+
         # Loads map
-        self.load_map()
+        self.load_map(data)
         
-        # Ensures atleast one Cucco is one screen
-        if not any(s.is_cucco() for s in self.sprites):
-            self.sprites.append(Cucco(self.link.x + 100, self.link.y))
+        # Ensures atleast one Cucco is one screen (chunked maps keep the cuccos they have)
+        if not self.cuccos and self.store is None:
+            self.add_sprite(self.make_cucco(self.link.x + 100, self.link.y))
         
     
-    # Save items to map.json
+    # Makes a cucco (backed by the flock engine when it is on)
+    def make_cucco(self, x, y):
+        return self.flock.spawn(x, y, self.rng) if self.flock is not None else Cucco(x, y, self.mood, self.rng)
+
+    # Adds a sprite to the world (static sprites also go into the broadphase grid)
+    def add_sprite(self, s):
+        self.sprites.add(s)
+        self.by_kind[s.KIND].add(s)
+        if s.is_static():
+            self.static_grid.insert(s)
+        if s.is_scenery():
+            self._scenery_changed(s)
+        self.room_index.update(s)
+        return s
+
+    # Marks the area under a tree or chest so cached backgrounds there get redrawn
+    # Inside a batch the areas are merged and handed to the view once, when the batch ends
+    def _scenery_changed(self, s):
+        if self.batch_depth:
+            r = self.batch_rect
+            self.batch_rect = (s.x, s.y, s.x + s.w, s.y + s.h) if r is None else \
+                (min(r[0], s.x), min(r[1], s.y), max(r[2], s.x + s.w), max(r[3], s.y + s.h))
+            return
+        if self.dirty_rects is not None:
+            self.dirty_rects.append((s.x, s.y, s.w, s.h))
+
+    # Groups bulk edits (brush strokes, deletes) so the room backgrounds are redrawn once for all of them
+    # (a stroke held over many frames is handed to the view a frame at a time by RoomBackgrounds.sync)
+    def begin_batch(self):
+        self.batch_depth += 1
+
+    def end_batch(self):
+        self.batch_depth -= 1
+        if self.batch_depth == 0 and self.batch_rect is not None:
+            x0, y0, x1, y1 = self.batch_rect
+            if self.dirty_rects is not None:
+                self.dirty_rects.append((x0, y0, x1 - x0, y1 - y0))
+            self.batch_rect = None
+
+    # Save items to map.json (or to the chunk files of a map folder)
+    # The world is snapshotted here and written on the background saver; returns the save's future
     def save_map(self):
-        trees = []
-        chests = []
-        cuccos = []
-        for s in self.sprites:
-            if s.is_tree():
-                trees.append(s.marshal())
-            elif s.is_chest():
-                chests.append(s.marshal())
-            elif s.is_cucco():
-                cuccos.append(s.marshal())
+        if self.store is not None:
+            self._spill_wanderers()
+            for c in self.loaded_chunks:
+                if self._chunk_changed(c):
+                    self.store.write(c[0], c[1], self._chunk_data(*c))
+            self.store.write_index(int(self.link.x), int(self.link.y))
+            return self.saver.last
+        data = self._map_data()
+        if os.path.isdir(self.filename):
+            return self.saver.submit(ChunkStore(self.filename).write_world, data)
+        future = self.saver.submit(write_map_atomic, self.filename, data)
+
+        # The journal only holds edits made after this snapshot
+        self.journal = []
+        self.journal_size = 0
+        self.saver.submit(self._truncate_journal, self.filename + ".journal")
+        return future
+
+    @staticmethod
+    def _truncate_journal(path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    # Queues an edit for the autosave journal
+    def _journal_edit(self, entry):
+        if self.autosave and not self.replaying and self.store is None:
+            self.journal.append(entry)
+
+    # Appends queued edits to the journal, or folds everything into a full save once it gets long
+    def autosave_now(self):
+        if self.store is not None:
+            self.save_map()
+            return
+        if self.journal_size + len(self.journal) > JOURNAL_COMPACT:
+            self.save_map()
+            return
+        if not self.journal:
+            return
+        lines = "".join(json.dumps(e) + "\n" for e in self.journal)
+        self.journal_size += len(self.journal)
+        self.journal = []
+        self.saver.submit(self._append_journal, self.filename + ".journal", lines)
+
+    @staticmethod
+    def _append_journal(path, lines):
+        with open(path, "a") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # Re-applies edits journaled after the last full save
+    def _replay_journal(self):
+        entries = []
+        try:
+            with open(self.filename + ".journal") as f:
+                for line in f:
+                    entries.append(json.loads(line))
+        except FileNotFoundError:
+            return
+        except ValueError:
+            pass    # A torn last line means the crash happened mid-append
+        self.replaying = True
+        for e in entries:
+            if e["op"] == "add":
+                self.add_item(e["type"], e["x"], e["y"])
+            elif e["op"] == "clear":
+                self.clear_map()
+            elif e["op"] == "remove":
+                self._replay_remove(e)
+        self.replaying = False
+        self.journal_size = len(entries)
+
+    def _replay_remove(self, e):
+        for o in (self.trees if e["type"] == "Tree" else self.chests):
+            if o.marshal() == {"x": e["x"], "y": e["y"]}:
+                self.delete_items([o])
+                return
+
+    # Whole world in map.json format
+    def _map_data(self):
         data = {
-            "trees": trees,
-            "chests": chests,
-            "cuccos": cuccos,
+            "trees": [s.marshal() for s in self.trees],
+            "chests": [s.marshal() for s in self.chests],
+            "cuccos": [s.marshal() for s in self.cuccos],
             "linkx": int(self.link.x),
             "linky": int(self.link.y)
         }
-        with open(Model.filename, "w") as f:
-            json.dump(data, f)
-
-    # Loads items from map.json
-    def load_map(self):
-        self.sprites = [self.link]
+        return data
+
+    # Empties the world (Link stays)
+    def _reset_world(self):
+        for s in self.projectiles:
+            self.boomerangs.release(s)
+        for r in self.by_kind.values():
+            r.reset()
+        self.sprites.reset([self.link])
+        self.active_cuccos = self.cuccos
+        self.expired = []
+        self.selection = []
+        self.static_grid = SpatialHash()
+        self.room_index.clear()
+        self.room_index.update(self.link)
+        self.map_version += 1
+        self.timers.clear()
+        if self.flock is not None:
+            self.flock.clear()
         self.rupees = 0
-        Cucco.reset()
-        try:
-            with open(Model.filename) as f:
-                data = json.load(f)
-        except FileNotFoundError:
+        self.mood.reset()
+        self.store = None
+        self.loaded_chunks = set()
+        self.dirty_chunks = set()
+        self.stream_room = None
+        self.journal = []
+        self.journal_size = 0
+
+    # Loads items from map.json (a map folder only loads the rooms around Link)
+    def load_map(self, data=None):
+        self.saver.wait()
+        folder = os.path.isdir(self.filename)
+        if not folder:
+            set_world_size(*DEFAULT_WORLD_SIZE)     # Undoes the size of a map folder loaded earlier in this process
+        self._reset_world()
+        if folder:
+            self.store = ChunkStore(self.filename, self.saver)
+            index = self.store.read_index()
+            set_world_size(index.get("world_w", WORLD_W), index.get("world_h", WORLD_H))
+            self.static_grid = SpatialHash()
+            self.link.x = index.get("linkx", 200)
+            self.link.y = index.get("linky", 300)
+            self._place_link()
             return
-        
-        trees = data.get("trees", [])
-        chests = data.get("chests", [])
-        cuccos = data.get("cuccos", [])
+        if data is None and is_binary_map(self.filename):
+            self._load_binary(self.filename)
+            self._replay_journal()
+        else:
+            if data is None:
+                data = read_map(self.filename)
+            if data is not None:
+                self._load_data(data)
+                self._replay_journal()
+        self._place_link()
+        if self.recording is not None:
+            self.recording.add("load", self._map_data())
+
+    # Files Link under the room the map put him in and moves the camera there
+    def _place_link(self):
+        self.room_index.update(self.link)
+        self.snap_camera()
+
+    # Adds the sprites of map.json-format data to an empty world
+    def _load_data(self, data):
         self.link.x = data.get("linkx", 200)
         self.link.y = data.get("linky", 300)
-        for e in trees:
-            self.sprites.append(Tree(e["x"], e["y"]))
-        for e in chests:
-            self.sprites.append(TreasureChest(e["x"], e["y"]))
-        for e in cuccos:
-            self.sprites.append(Cucco(e["x"], e["y"]))
-    
-
-    # Clear map    
+        self._load_positions(((e["x"], e["y"]) for e in data.get("trees", [])),
+                             ((e["x"], e["y"]) for e in data.get("chests", [])),
+                             ((e["x"], e["y"]) for e in data.get("cuccos", [])))
+
+    # Adds the sprites of a binary map to an empty world, reading positions straight from the mapped file
+    def _load_binary(self, path):
+        with MapFile(path) as mf:
+            self.link.x, self.link.y = mf.link if mf.link is not None else (200, 300)
+            self._load_positions(mf.positions("trees"), mf.positions("chests"), mf.positions("cuccos"))
+
+    # Builds trees, chests and cuccos from x, y pairs as one batch
+    def _load_positions(self, trees, chests, cuccos):
+        self.begin_batch()
+        for x, y in trees:
+            self.add_sprite(Tree(x, y))
+        for x, y in chests:
+            self.add_sprite(TreasureChest(x, y))
+        for x, y in cuccos:
+            self.add_sprite(self.make_cucco(x, y))
+        self.end_batch()
+
+
+    # Clear map (a chunked map is left alone on disk until the cleared world is saved over it)
     def clear_map(self):
-        self.sprites = [self.link]
-        self.rupees = 0
-        Cucco.reset()
-        self.sprites.append(Cucco(self.link.x + 120, self.link.y))
+        journal_size = self.journal_size
+        self._reset_world()
+        self.journal_size = journal_size
+        self._journal_edit({"op": "clear"})
+        self._record("clear")
+        self.add_sprite(self.make_cucco(self.link.x + 120, self.link.y))
 
     # Add selected sprite to game world
     # Screen click is converted to world coordinates
     def add_at(self, screen_pos):
         wx = screen_pos[0] + self.camX
         wy = screen_pos[1] + self.camY
-        if self.add_type == "Tree":
-            self.sprites.append(Tree(wx, wy))
-        elif self.add_type == "Chest":
-            self.sprites.append(TreasureChest(wx, wy))
-        elif self.add_type == "Cucco":
-            self.sprites.append(Cucco(wx, wy))
+        self.add_item(self.add_type, wx, wy)
+
+    # Brush: a stroke places add_type along the drag, brush_spacing apart, skipping spots taken by trees and chests
+    def begin_stroke(self, screen_pos):
+        self.begin_batch()
+        self.stroke_last = None
+        self.stroke_to(screen_pos)
+
+    def stroke_to(self, screen_pos):
+        wx = screen_pos[0] + self.camX
+        wy = screen_pos[1] + self.camY
+        if self.stroke_last is None:
+            self._paint(wx, wy)
+            self.stroke_last = (wx, wy)
+            return
+        lx, ly = self.stroke_last
+        dist = math.sqrt((wx - lx) ** 2 + (wy - ly) ** 2)
+        steps = int(dist // self.brush_spacing)
+        for k in range(1, steps + 1):
+            self._paint(int(lx + (wx - lx) * k * self.brush_spacing / dist), int(ly + (wy - ly) * k * self.brush_spacing / dist))
+        if steps:
+            self.stroke_last = (lx + (wx - lx) * steps * self.brush_spacing / dist, ly + (wy - ly) * steps * self.brush_spacing / dist)
+
+    def end_stroke(self):
+        if self.stroke_last is not None:
+            self.stroke_last = None
+            self.end_batch()
+
+    def _paint(self, wx, wy):
+        w, h = {"Tree": (Tree.TREE_W, Tree.TREE_H), "Chest": (TreasureChest.CHEST_W, TreasureChest.CHEST_H),
+                "Cucco": (Cucco.CUCCO_W, Cucco.CUCCO_H)}[self.add_type]
+        if not self.brush_overlap:
+            spot = pygame.Rect(wx, wy, w, h)
+            if any(aabb_collide(spot, o) for o in self.static_grid.query(spot)):
+                return
+        self.add_item(self.add_type, wx, wy)
+
+    # Trees, chests and cuccos overlapping a world rectangle (trees and chests come from the broadphase grid)
+    def pick(self, x, y, w, h):
+        box = pygame.Rect(int(x), int(y), max(1, int(w)), max(1, int(h)))
+        found = [o for o in self.static_grid.query(box) if aabb_collide(box, o)]
+        found.extend(o for o in self.room_index.visible(x, y, w, h) if o.is_cucco())
+        return sorted(found, key=lambda o: o._at)
+
+    def select_rect(self, x, y, w, h):
+        self.selection = self.pick(x, y, w, h)
+        return self.selection
+
+    # Deletes the selection as one batch
+    def delete_selection(self):
+        sprites = [o for o in self.selection if self._in_world(o)]
+        self.selection = []
+        if sprites:
+            self._record("delete", [o._at for o in sprites])
+            self.delete_items(sprites)
+
+    def delete_items(self, sprites):
+        self.begin_batch()
+        for o in sprites:
+            if o.is_cucco():
+                # Cuccos move, so the journal can't find them again by position: the next autosave writes the whole map
+                if self.autosave and not self.replaying and self.store is None:
+                    self.journal_size = JOURNAL_COMPACT + 1
+                self.mood.count = max(0, self.mood.count - 1)
+                self.dirty_chunks.add(self._home_chunk(o))
+                o.dead = True
+            else:
+                self._journal_edit({"op": "remove", "type": "Tree" if o.is_tree() else "Chest", **o.marshal()})
+            self._remove_sprite(o)
+        self.end_batch()
+
+    def _in_world(self, o):
+        reg = self.by_kind.get(o.KIND)
+        return reg is not None and o._kind_at < len(reg) and reg[o._kind_at] is o
+
+    # Adds a Tree, Chest or Cucco at world coordinates
+    def add_item(self, kind, wx, wy):
+        self.dirty_chunks.add((int(wx // VIEW_W), int(wy // VIEW_H)))
+        self._journal_edit({"op": "add", "type": kind, "x": wx, "y": wy})
+        self._record("add", kind, wx, wy)
+        if kind == "Tree":
+            self.add_sprite(Tree(wx, wy))
+        elif kind == "Chest":
+            self.add_sprite(TreasureChest(wx, wy))
+        elif kind == "Cucco":
+            self.add_sprite(self.make_cucco(wx, wy))
+
+    # Rebuilds the world from map data with a freshly seeded RNG and a new Link (recordings start and replay from here)
+    def restart(self, seed, data):
+        self.seed = seed
+        self.rng.seed(seed)
+        self.link = Link(data.get("linkx", 200), data.get("linky", 300))
+        self._reset_world()
+        self._load_data(data)
+        self._place_link()
+
+    # Starts recording from the current map (the world restarts so a replay can match it from tick 0)
+    def start_recording(self, seed=None):
+        seed = self.seed if seed is None else seed
+        data = self._map_data()
+        self.restart(seed, data)
+        self.recording = Recording(seed, data)
+        return self.recording
+
+    # Stops recording and writes it (with the final state hash) to path
+    def stop_recording(self, path):
+        rec = self.recording
+        self.recording = None
+        rec.hash = self.state_hash()
+        rec.save(path)
+        return rec
+
+    def _record(self, *event):
+        if self.recording is not None and not self.replaying:
+            self.recording.add(*event)
+
+    # Applies one recorded event (edits are not journaled or recorded again)
+    def apply(self, event):
+        op = event[0]
+        self.replaying = True
+        if op == "input":
+            self.link.set_input(event[1], event[2])
+        elif op == "throw":
+            self.throw_boomerang()
+        elif op == "add":
+            self.add_item(event[1], event[2], event[3])
+        elif op == "clear":
+            self.clear_map()
+        elif op == "delete":
+            self.delete_items([self.sprites[i] for i in event[1]])
+        elif op == "load":
+            self._reset_world()
+            self._load_data(event[1])
+            self._place_link()
+        self.replaying = False
+
+    # Hash of everything the simulation decides (positions, rupees and flock counters)
+    def state_hash(self):
+        h = hashlib.sha1()
+        h.update(repr((self.rupees, self.mood.count, self.mood.hits, self.mood.angry, self.mood.disappeared)).encode())
+        for s in self.sprites:
+            h.update(repr((s.KIND, s.x, s.y, s.dead)).encode())
+        return h.hexdigest()
+
+    # Link's movement input for the next tick
+    def set_input(self, dx, dy):
+        if (dx, dy) != (self.link.dx, self.link.dy):
+            self._record("input", dx, dy)
+        self.link.set_input(dx, dy)
 
     # Allows link to throw boomerang from middle of his chest
     def throw_boomerang(self):
+        self._record("throw")
         cx = self.link.x + self.link.w/2
         cy = self.link.y + self.link.h/2
-        self.sprites.append(Boomerang(cx, cy, self.link.direction))
+        b = self.boomerangs.acquire(cx, cy, self.link.direction)
+        if b is not None:
+            self.add_sprite(b)
     
     # Displays ruppee counter
     def _collect_rupee(self, chest):
         self.rupees += 1
-        chest.collect()
+        chest.collect(self.timers, self.expired)
+
+    # Opening a chest takes it out of the room background
+    def _open_chest(self, chest):
+        if not chest.opened:
+            chest.open(self.timers, self.expired)
+            self._scenery_changed(chest)
 
     # Update method
     def update(self):
-        for i in range(len(self.sprites) - 1, -1, -1):
-            s = self.sprites[i]
-            if isinstance(s, Cucco):
+        prof = self.profiler
+        if prof is None:
+            self.update_sprites()
+            self.handle_collisions()
+            self.snap_camera()
+        else:
+            prof.time("sprites", self.update_sprites)
+            prof.time("collisions", self.handle_collisions)
+            prof.time("camera", self.snap_camera)
+        if self.autosave and self.timers.tick % AUTOSAVE_TICKS == 0:
+            self.autosave_now()
+        if self.recording is not None:
+            self.recording.ticks += 1
+
+    # Moves every sprite and drops the dead ones
+    def update_sprites(self):
+        # Flock chases Link's center
+        self.mood.linkx = self.link.x + self.link.w/2
+        self.mood.linky = self.link.y + self.link.h/2
+
+        # Fires rupee and pecking timers that are due
+        self.timers.advance()
+
+        if self.flock is not None:
+            self.flock.step(self.link)
+
+        # Only boomerangs, cuccos and Link move (trees and chests change through timers)
+        for i in range(len(self.projectiles) - 1, -1, -1):
+            s = self.projectiles[i]
+            s.update()
+            if s.to_remove:
+                self._remove_sprite(s)
+        if self.lod and self.flock is None:
+            self._update_cuccos_lod()
+        else:
+            for i in range(len(self.cuccos) - 1, -1, -1):
+                s = self.cuccos[i]
                 s.update(self.link)
-            else:
-                s.update()
-            if getattr(s, "dead", False) or getattr(s, "to_remove", False):
-                self.sprites.pop(i)
-            
+                if s.dead or s.to_remove:
+                    self._remove_sprite(s)
+            self.active_cuccos = self.cuccos
+            self.lod_last = (len(self.cuccos), 0)
+            self.lod_ticks[0] += len(self.cuccos)
+
+        # Link moves after the cuccos (attached ones follow where he was)
+        self.link.update()
+
+        # Rupees whose time ran out (back to front, skipping chests that already left the world)
+        if self.expired:
+            for s in sorted(self.expired, key=lambda s: s._kind_at, reverse=True):
+                if self._in_world(s):
+                    self._remove_sprite(s)
+            self.expired = []
+
         # Ensures at least one Cucco is on screen
-        if not any(s.is_cucco() for s in self.sprites):
-            self.sprites.append(Cucco(self.link.x + 80, self.link.y + 40))
-
-        # Collison handling
-        n = len(self.sprites)
-        for i in range(n):
-            a = self.sprites[i]
-            for j in range(i + 1, n):
-                b = self.sprites[j]
-                if not aabb_collide(a, b):
+        # (not on a chunked map, where an empty area just means its cuccos aren't loaded and a spawned one would be saved)
+        if not self.cuccos and self.store is None:
+            self.add_sprite(self.make_cucco(self.link.x + 80, self.link.y + 40))
+
+    # Level of detail: cuccos in the rooms around Link move every tick, the rest are visited round robin
+    # so each one moves about once every LOD_FAR_STEP ticks, catching up on the ticks it missed
+    def _update_cuccos_lod(self):
+        tick = self.timers.tick
+        active = []
+        near = []
+        rx, ry = int(self.mood.linkx // VIEW_W), int(self.mood.linky // VIEW_H)
+        for y in range(ry - LOD_NEAR_RADIUS, ry + LOD_NEAR_RADIUS + 1):
+            for x in range(rx - LOD_NEAR_RADIUS, rx + LOD_NEAR_RADIUS + 1):
+                room = self.room_index.rooms.get((x, y))
+                if room:
+                    near.extend(s for s in room.values() if s.is_cucco())
+        far = []
+        cuccos = self.cuccos
+        for _ in range(min(len(cuccos), -(-len(cuccos) // LOD_FAR_STEP))):
+            self.lod_cursor = (self.lod_cursor - 1) % len(cuccos)
+            far.append(cuccos[self.lod_cursor])
+
+        counts = [0, 0]
+        for tier, group in enumerate((near, far)):
+            for s in group:
+                if s.lod_tick == tick:
                     continue
-
-                # Link vs Tree or Chest (Link pushes back when chest is closed)
-                if a.is_link() and (b.is_tree() or (b.is_chest() and b.is_item())):
-                    a.push_back(b)
-                elif b.is_link() and (a.is_tree() or (a.is_chest() and a.os_item())):
-                    b.push_back(a)
-
-                # Link vs chest (Collects if chest is open)
-                if a.is_link() and b.is_chest():
-                    if not b.opened:
-                        a.push_back(b); b.open()
-                    elif b.can_collect():
-                        self._collect_rupee(b)
-                elif b.is_link() and a.is_chest():
-                    if not a.opened:
-                        b.push_back(a); a.open()
-                    elif a.can_collect():
-                        self._collect_rupee(a)
-
-                # Boomerang vs Tree (Boomerang dies after collision)
-                if a.is_boomerang() and b.is_tree():
-                    a.kill()
-                elif b.is_boomerang() and a.is_tree():
-                    b.kill()
-                
-                # Boomerang vs Chest (Boomerang dies after collison)
-                if a.is_boomerang() and b.is_chest():
-                    if not b.opened:
-                        b.open()
-                    else:
-                        self._collect_rupee(b)
-                        a.kill()
-                elif b.is_boomerang() and a.is_chest():
-                    if not a.opened:
-                        a.open()
-                    else: 
-                        self._collect_rupee(a)
-                        b.kill()
-                
-                # Helps cucco bounce off items
-                def cucco_bounce(cucco, item):
-                    if isinstance(cucco, Cucco) and not Cucco.ANGRY:
-                        cucco._bounce_from_item(item)
-                
-                # Cucco vs Tree or chest (Bounces when he's not angry)
-                if a.is_cucco() and (b.is_tree() or b.is_chest()):
-                    cucco_bounce(a, b)
-                elif b.is_cucco() and (a.is_tree() or a.is_chest()):
-                    cucco_bounce(b, a)
-
-                # Cucco vs Link (Attaches to Link when angry, hit count total increases)
-                if a.is_cucco() and b.is_link():
-                    if not Cucco.ANGRY:
-                        a._bounce_from_item(b)
-                    a.is_hit()
-                    if Cucco.ANGRY:
-                        a.attach_to_link()
-                elif b.is_cucco() and a.is_link():
-                    if not Cucco.ANGRY:
-                        b._bounce_from_item(a)
-                    b.is_hit()
-                    if Cucco.ANGRY:
-                        b.attach_to_link()
-
-                # Boomerang vs Cucco (Boomerang dies after collion, hit count total increases)
-                # Attaches to Link when hit
-                if a.is_boomerang() and b.is_cucco():
-                    b.is_hit(); a.kill()
-                    if Cucco.ANGRY:
-                        b.attach_to_link()
-                elif b.is_boomerang() and a.is_cucco():
-                    a.is_hit(); b.kill()
-                    if Cucco.ANGRY:
-                        a.attach_to_link()
-
-        # Snaps camera to room
+                dt = tick - s.lod_tick if s.lod_tick is not None else 1
+                s.lod_tick = tick
+                if not s.to_remove:
+                    s.update(self.link, dt)
+                    counts[tier] += 1
+                if s.dead or s.to_remove:
+                    self._remove_sprite(s)
+                else:
+                    active.append(s)
+        self.active_cuccos = active
+        self.lod_last = tuple(counts)
+        self.lod_ticks[0] += counts[0]
+        self.lod_ticks[1] += counts[1]
+
+    # Takes a dead sprite out of the world (the last sprite of each registry fills its place)
+    def _remove_sprite(self, s):
+        self.sprites.discard(s)
+        self.by_kind[s.KIND].discard(s)
+        if s.is_static():
+            self.static_grid.remove(s)
+            self._scenery_changed(s)
+            self.dirty_chunks.add(self._home_chunk(s))
+        if self.flock is not None and s.is_cucco():
+            self.flock.remove(s)
+        if s.is_boomerang():
+            self.boomerangs.release(s)
+        self.room_index.remove(s)
+
+    # Collison handling
+    def handle_collisions(self):
+        fast = self._fast_movers() if self.continuous else {}
+        if self.broadphase:
+            pairs = self._candidate_pairs(fast)
+            self.pairs_tested = len(pairs)
+        else:
+            # Every pair with at least one mover in it (the same pairs the broadphase can return, so LOD gives equal results)
+            n = len(self.sprites)
+            movers = {s._at for s in self._movers()}
+            pairs = ((i, j) for i in range(n) for j in range(i + 1, n) if i in movers or j in movers)
+            rest = n - len(movers)
+            self.pairs_tested = n * (n - 1) // 2 - rest * (rest - 1) // 2
+        hits = 0
+        sprites = self.sprites
+        for i, j in pairs:
+            a = sprites[i]
+            b = sprites[j]
+            handler = COLLISIONS.get((a.KIND, b.KIND))
+            if handler is not None and (aabb_collide(a, b) or (i in fast or j in fast) and sweep_aabb(a, b) is not None):
+                hits += 1
+                handler(self, a, b)
+        self.pairs_hit = hits
+
+        # Re-files moved sprites in the room index
+        for s in self._movers():
+            self.room_index.update(s)
+
+    # Snaps camera to room
+    def snap_camera(self):
         midx = self.link.x + self.link.w/2
         midy = self.link.y + self.link.h/2
-        roomX = int(midx // VIEW_W)
-        roomY = int(midy // VIEW_H)
-        self.camX = max(0, min(roomX * VIEW_W, WORLD_W - VIEW_W))
-        self.camY = max(0, min(roomY * VIEW_H, WORLD_H - VIEW_H))
+        self.roomX = int(midx // VIEW_W)
+        self.roomY = int(midy // VIEW_H)
+        self.camX, self.camY = room_camera(self.roomX, self.roomY)
+        if self.store is not None and self.stream_room != (self.roomX, self.roomY):
+            self.stream_room = (self.roomX, self.roomY)
+            self._stream_chunks()
+
+    # Room a chunked map files a sprite under
+    def _home_chunk(self, s):
+        return (int(s.x // VIEW_W), int(s.y // VIEW_H))
+
+    # Loads the rooms near Link and writes back / drops the far ones
+    def _stream_chunks(self):
+        rx, ry = self.stream_room
+        far = [c for c in self.loaded_chunks if max(abs(c[0] - rx), abs(c[1] - ry)) > CHUNK_KEEP_RADIUS]
+        for c in far:
+            self._evict_chunk(c)
+        self._spill_wanderers()
+
+        cols = int(math.ceil(WORLD_W / VIEW_W))
+        rows = int(math.ceil(WORLD_H / VIEW_H))
+        for cy in range(max(0, ry - CHUNK_LOAD_RADIUS), min(rows, ry + CHUNK_LOAD_RADIUS + 1)):
+            for cx in range(max(0, rx - CHUNK_LOAD_RADIUS), min(cols, rx + CHUNK_LOAD_RADIUS + 1)):
+                if (cx, cy) not in self.loaded_chunks:
+                    self._load_chunk(cx, cy)
+
+    def _load_chunk(self, rx, ry):
+        data = self.store.read(rx, ry)
+        self.loaded_chunks.add((rx, ry))
+        for e in data.get("trees", []):
+            self.add_sprite(Tree(e["x"], e["y"]))
+        for e in data.get("chests", []):
+            self.add_sprite(TreasureChest(e["x"], e["y"]))
+        for e in data.get("cuccos", []):
+            self.add_sprite(self.make_cucco(e["x"], e["y"]))
+
+        # Cuccos move, so the room has to be written back when it is dropped
+        if data.get("cuccos"):
+            self.dirty_chunks.add((rx, ry))
+
+    # Cuccos that wandered into rooms that aren't loaded get written into those rooms and dropped
+    def _spill_wanderers(self):
+        for s in [s for s in self.cuccos if self._home_chunk(s) not in self.loaded_chunks]:
+            c = self._home_chunk(s)
+            data = self.store.read(*c)
+            data["cuccos"].append(s.marshal())
+            self.store.write(c[0], c[1], data)
+            self._unload_sprite(s)
+
+    # A room needs writing if it was edited, loaded with cuccos, or a cucco has wandered in
+    def _chunk_changed(self, c, sprites=None):
+        if c in self.dirty_chunks:
+            return True
+        return any(s.is_cucco() for s in (sprites if sprites is not None else self._chunk_sprites(*c)))
+
+    # Entities of one loaded room in map.json format
+    def _chunk_data(self, rx, ry):
+        data = {"trees": [], "chests": [], "cuccos": []}
+        for s in self._chunk_sprites(rx, ry):
+            kind = "trees" if s.is_tree() else "chests" if s.is_chest() else "cuccos"
+            data[kind].append(s.marshal())
+        return data
+
+    def _chunk_sprites(self, rx, ry):
+        room = self.room_index.rooms.get((rx, ry), {})
+        return [s for s in room.values()
+                if (s.is_tree() or s.is_chest() or s.is_cucco()) and self._home_chunk(s) == (rx, ry)]
+
+    # Writes a room back if it changed and takes its sprites out of the world
+    def _evict_chunk(self, c):
+        sprites = self._chunk_sprites(*c)
+        if self._chunk_changed(c, sprites):
+            self.store.write(c[0], c[1], self._chunk_data(*c))
+            self.dirty_chunks.discard(c)
+        self.loaded_chunks.discard(c)
+        for s in sprites:
+            self._unload_sprite(s)
+
+    def _unload_sprite(self, s):
+        self.sprites.discard(s)
+        self.by_kind[s.KIND].discard(s)
+        if s.is_static():
+            self.static_grid.remove(s)
+            if s.is_scenery():
+                self._scenery_changed(s)
+        if s.is_cucco():
+            self.mood.count = max(0, self.mood.count - 1)
+            s.dead = True
+            if self.flock is not None:
+                self.flock.remove(s)
+        self.room_index.remove(s)
+
+    # Broadphase: index pairs (i < j) of sprites that share a grid cell, in the same order as the brute-force loop
+    # Moving sprites are re-bucketed every tick and static-static pairs are skipped (they never react)
+    # The search is widened by LINK_SPEED so a push back during the tick can't miss a neighbour
+    # For fast movers the search and the moving grid also cover the path they took this tick
+    def _candidate_pairs(self, fast=None):
+        fast = fast or {}
+        moving = SpatialHash()
+        pairs = set()
+        for s in self._movers():
+            i = s._at
+            margin = max(LINK_SPEED, fast.get(i, 0))
+            for grid in (self.static_grid, moving):
+                for o in grid.query(s, margin):
+                    j = o._at
+                    pairs.add((i, j) if i < j else (j, i))
+            moving.insert(s, margin - LINK_SPEED)
+
+        # Cuccos LOD skipped this tick are in neither grid, but a boomerang can still fly into one
+        if self.active_cuccos is not self.cuccos:
+            for s in self.projectiles:
+                i = s._at
+                margin = max(LINK_SPEED, fast.get(i, 0))
+                for o in self.room_index.visible(s.x - margin, s.y - margin, s.w + 2 * margin, s.h + 2 * margin):
+                    if o.is_cucco():
+                        j = o._at
+                        pairs.add((i, j) if i < j else (j, i))
+        return sorted(pairs)
+
+    # Movers that went SWEPT_MIN_TRAVEL or further this tick: index in sprites -> pixels moved
+    def _fast_movers(self):
+        fast = {}
+        for s in self._movers():
+            d = travel(s)
+            if d >= SWEPT_MIN_TRAVEL:
+                fast[s._at] = d
+        return fast
+
+    # Link, then every boomerang and the cuccos that moved this tick
+    def _movers(self):
+        yield self.link
+        yield from self.projectiles
+        yield from self.active_cuccos
+
+    # Link vs Tree (Link pushes back)
+    def _link_vs_tree(self, link, tree):
+        link.push_back(tree)
+
+    # Link vs chest (Link pushes back and opens a closed chest, collects if chest is open)
+    def _link_vs_chest(self, link, chest):
+        if not chest.opened:
+            link.push_back(chest); self._open_chest(chest)
+        elif chest.can_collect():
+            self._collect_rupee(chest)
+
+    # Boomerang vs Tree (Boomerang dies after collision)
+    def _boomerang_vs_tree(self, boomerang, tree):
+        boomerang.kill(tree)
+
+    # Boomerang vs Chest (opens a closed chest, otherwise collects and dies)
+    def _boomerang_vs_chest(self, boomerang, chest):
+        if not chest.opened:
+            self._open_chest(chest)
+        else:
+            self._collect_rupee(chest)
+            boomerang.kill(chest)
+
+    # Cucco vs Tree or chest (Bounces when he's not angry)
+    def _cucco_vs_item(self, cucco, item):
+        if not self.mood.angry:
+            cucco._bounce_from_item(item)
+
+    # Cucco vs Link (Attaches to Link when angry, hit count total increases)
+    def _cucco_vs_link(self, cucco, link):
+        if not self.mood.angry:
+            cucco._bounce_from_item(link)
+        cucco.is_hit()
+        if self.mood.angry:
+            cucco.attach_to_link(self.timers)
+
+    # Boomerang vs Cucco (Boomerang dies after collion, hit count total increases)
+    # Attaches to Link when hit
+    def _boomerang_vs_cucco(self, boomerang, cucco):
+        cucco.is_hit(); boomerang.kill(cucco)
+        if self.mood.angry:
+            cucco.attach_to_link(self.timers)
+
+# Collision table
+# (kind of a, kind of b) -> handler(model, a, b); pairs without an entry don't react
+COLLISIONS = {}
+
+# Registers a response for two sprite kinds (in both orders)
+def register_collision(kind_a, kind_b, handler):
+    COLLISIONS[(kind_a, kind_b)] = handler
+    COLLISIONS[(kind_b, kind_a)] = lambda model, b, a: handler(model, a, b)
+
+register_collision(KIND_LINK, KIND_TREE, Model._link_vs_tree)
+register_collision(KIND_LINK, KIND_CHEST, Model._link_vs_chest)
+register_collision(KIND_BOOMERANG, KIND_TREE, Model._boomerang_vs_tree)
+register_collision(KIND_BOOMERANG, KIND_CHEST, Model._boomerang_vs_chest)
+register_collision(KIND_CUCCO, KIND_TREE, Model._cucco_vs_item)
+register_collision(KIND_CUCCO, KIND_CHEST, Model._cucco_vs_item)
+register_collision(KIND_CUCCO, KIND_LINK, Model._cucco_vs_link)
+register_collision(KIND_BOOMERANG, KIND_CUCCO, Model._boomerang_vs_cucco)
+
+# Room background cache
+# Each room's fill color, trees and closed chests are drawn once into an off-screen surface
+# Only the most recently used rooms are kept
+class RoomBackgrounds():
+    def __init__(self, model, max_rooms=BG_CACHE_ROOMS):
+        self.model = model
+        self.max_rooms = max_rooms
+        self.rooms = OrderedDict()      # (camX, camY, edit_mode) -> surface
+        self.version = model.map_version
+        model.dirty_rects = []          # Starts collecting scenery changes for sync
+
+    def get(self, camX, camY, edit_mode):
+        key = (camX, camY, edit_mode)
+        surf = self.rooms.get(key)
+        if surf is None:
+            surf = self._render(camX, camY, edit_mode)
+            self.rooms[key] = surf
+            while len(self.rooms) > self.max_rooms:
+                self.rooms.popitem(last=False)
+        else:
+            self.rooms.move_to_end(key)
+        return surf
+
+    def has(self, camX, camY, edit_mode):
+        return (camX, camY, edit_mode) in self.rooms
+
+    def _render(self, camX, camY, edit_mode):
+        surf = pygame.Surface((VIEW_W, VIEW_H))
+        if pygame.display.get_surface():
+            surf = surf.convert()
+        surf.fill([146, 203, 146] if edit_mode else [72, 152, 72])
+        for s in self.model.room_index.visible(camX, camY, VIEW_W, VIEW_H):
+            if s.is_scenery():
+                img = s.get_draw_image()
+                surf.blit(SCALED.get(img, s.w, s.h), (int(s.x - camX), int(s.y - camY)))
+        return surf
+
+    # Drops rooms touched by scenery changes since the last frame
+    # A batch still open (a brush stroke mid-drag) hands over what it has changed so far, so painting shows up as it happens
+    def sync(self):
+        if self.version != self.model.map_version:
+            self.version = self.model.map_version
+            self.rooms.clear()
+        if self.model.batch_rect is not None:
+            x0, y0, x1, y1 = self.model.batch_rect
+            self.model.dirty_rects.append((x0, y0, x1 - x0, y1 - y0))
+            self.model.batch_rect = None
+        if self.model.dirty_rects:
+            for x, y, w, h in self.model.dirty_rects:
+                for key in [k for k in self.rooms if x < k[0] + VIEW_W and x + w > k[0] and y < k[1] + VIEW_H and y + h > k[1]]:
+                    del self.rooms[key]
+            self.model.dirty_rects.clear()
 
-                        
 # View Class
 class View():
     def __init__(self, model):
         self.model = model
         self.screen = pygame.display.set_mode((VIEW_W, VIEW_H), 32)
 
-    def update(self):
-        # change background color if the user is in edit_mode
-        if Controller.edit_mode:
-            self.screen.fill([146, 203, 146]) #light green
-        else:
-            self.screen.fill([72, 152, 72]) #dark forest green
+        # Sprites drawn and culled, and surfaces blitted, in the last frame
+        self.drawn = 0
+        self.skipped = 0
+        self.blits = 0
+        self.profile_font = None
+
+        # HUD text (default font, size 32) and the state it was last rendered for
+        self.text = TextCache(32)
+        self.hud_state = None
+        self.hud_surf = None
 
-        # draw sprites to the screen
-        for s in self.model.sprites:
+        # Pre-rendered static room layers
+        self.backgrounds = RoomBackgrounds(model)
+
+    def update(self):
+        # draw the cached room background (color depends on edit_mode, trees and closed chests baked in)
+        self.backgrounds.sync()
+        self.screen.blit(self.backgrounds.get(self.model.camX, self.model.camY, self.model.edit_mode), (0, 0))
+        blits = 1
+
+        # draw moving sprites in the current room to the screen
+        visible = self.model.room_index.visible(self.model.camX, self.model.camY, VIEW_W, VIEW_H)
+        self.drawn = len(visible)
+        self.skipped = len(self.model.sprites) - self.drawn
+        for s in visible:
+            if s.is_scenery():
+                continue
             img = s.get_draw_image()
             draw_x = int(s.x - self.model.camX)
             draw_y = int(s.y - self.model.camY)
             if img is not None:
-                self.screen.blit(pygame.transform.scale(img, (s.w, s.h)), (draw_x, draw_y))
+                self.screen.blit(SCALED.get(img, s.w, s.h), (draw_x, draw_y))
+                blits += 1
             else:
                 pygame.draw.rect(self.screen, (255, 213, 79), pygame.Rect(draw_x, draw_y, s.w, s.h))
 
-        # add text to the screen
-        # Default font, size 32
-        font = pygame.font.SysFont(None, 32)   
-        text = f"Rupees: {self.model.rupees}    Mode: {'EDIT' if Controller.edit_mode else 'GAME'} Add: {self.model.add_type}"
-        surf = font.render(text, True, (0, 0, 0))
+        blits += self._draw_hud()
+        self.blits = blits
+
+        # Profiler overlay
+        prof = self.model.profiler
+        if prof is not None and prof.overlay and prof.history:
+            self._draw_profile(prof)
+        
+        # update display screen
+        pygame.display.flip()
+
+        # Renders at most one neighbouring room ahead of time so walking into it doesn't hitch
+        self._prefetch()
+
+    # HUD text and the edit box (returns the surfaces blitted)
+    def _draw_hud(self):
+        blits = 0
+        # add text to the screen (only rendered again when the rupees, mode or item change)
+        hud = (self.model.rupees, self.model.edit_mode, self.model.add_type)
+        if hud != self.hud_state:
+            self.hud_state = hud
+            text = f"Rupees: {self.model.rupees}    Mode: {'EDIT' if self.model.edit_mode else 'GAME'} Add: {self.model.add_type}"
+            self.hud_surf = self.text.get(text, (0, 0, 0))
+        surf = self.hud_surf
         self.screen.blit(surf, (VIEW_W - surf.get_width() - 12, 10))
+        blits += 1
 
         # Edit mode
-        if Controller.edit_mode:
+        if self.model.edit_mode:
+            # Selected sprites and the selection box being dragged
+            camX, camY = self.model.camX, self.model.camY
+            for o in self.model.selection:
+                pygame.draw.rect(self.screen, (255, 255, 0), (o.x - camX, o.y - camY, o.w, o.h), 2)
+            if self.model.select_box is not None:
+                x, y, w, h = self.model.select_box
+                pygame.draw.rect(self.screen, (255, 255, 255), (x - camX, y - camY, w, h), 1)
+
             pygame.draw.rect(self.screen, (235, 255, 235), EDIT_BOX, border_radius = 8)
             pygame.draw.rect(self.screen, (30, 120, 30), EDIT_BOX, 2, border_radius = 8)
-            s1 = font.render("Click to cycle item", True, (0, 60, 0))
+            s1 = self.text.get("Click to cycle item", (0, 60, 0))
             self.screen.blit(s1, (EDIT_BOX.x + 8, EDIT_BOX.y + 8))
+            blits += 1
 
             # Shows sprite in edix box (scaled to fit in the box)
             sprite = self.model.sprite.get(self.model.add_type)
@@ -701,20 +2529,55 @@ class View():
                 pw, ph = max(1, int(iw * scale)), max(1, int(ih * scale))
                 px = EDIT_BOX.x + (EDIT_BOX.width - pw) // 2
                 py = EDIT_BOX.y + EDIT_BOX.height - ph - 6
-                self.screen.blit(pygame.transform.scale(sprite, (pw, ph)), (px, py))
-        
-        # update display screen
-        pygame.display.flip()
+                self.screen.blit(SCALED.get(sprite, pw, ph), (px, py))
+                blits += 1
+        return blits
+
+    # Phase averages, counts and a frame-time histogram in the bottom-left corner
+    def _draw_profile(self, prof):
+        if self.profile_font is None:
+            self.profile_font = pygame.font.SysFont(None, 20)
+        box = pygame.Rect(10, VIEW_H - 190, 300, 180)
+        pygame.draw.rect(self.screen, (0, 0, 0), box)
+        lines = [f"{name} {ms:.2f} ms" for name, ms in prof.averages().items()]
+        counts = prof.history[-1]["counts"]
+        lines.append(f"pairs {counts.get('pairs_tested', 0)} tested / {counts.get('pairs_hit', 0)} hit")
+        lines.append(f"blits {self.blits}  drawn {self.drawn}  skipped {self.skipped}")
+        lines.append(f"boomerangs {counts.get('boomerangs_in_use', 0)} in use / {counts.get('boomerangs_high_water', 0)} peak")
+        lines.append(f"cuccos moved {counts.get('cuccos_near', 0)} near / {counts.get('cuccos_far', 0)} far")
+        lines.append("  ".join(f"{k} {n}" for k, n in counts.items() if k[0].isupper()))
+        for i, line in enumerate(lines):
+            self.screen.blit(self.profile_font.render(line, True, (255, 255, 255)), (box.x + 6, box.y + 4 + 15 * i))
+
+        # One bar per tick, the red line is the tick budget
+        budget = 1000.0 / TICK_RATE
+        base = box.bottom - 4
+        scale = 40 / budget
+        for i, r in enumerate(prof.history):
+            h = min(80, int(Profiler.frame_ms(r) * scale))
+            color = (230, 80, 80) if Profiler.frame_ms(r) > budget else (120, 220, 120)
+            pygame.draw.line(self.screen, color, (box.x + 6 + 2 * i, base), (box.x + 6 + 2 * i, base - h))
+        pygame.draw.line(self.screen, (255, 0, 0), (box.x + 4, base - 40), (box.right - 4, base - 40))
+
+    # Pre-renders the backgrounds of the four rooms next to Link's room
+    def _prefetch(self):
+        rx, ry = self.model.roomX, self.model.roomY
+        for nx, ny in ((rx - 1, ry), (rx + 1, ry), (rx, ry - 1), (rx, ry + 1)):
+            if nx < 0 or ny < 0 or nx * VIEW_W >= WORLD_W or ny * VIEW_H >= WORLD_H:
+                continue
+            camX, camY = room_camera(nx, ny)
+            if not self.backgrounds.has(camX, camY, self.model.edit_mode):
+                self.backgrounds.get(camX, camY, self.model.edit_mode)
+                return
 
 # Controller Class
 class Controller():
-    edit_mode = False
-    
     def __init__(self, model, view):
         self.model = model
         self.view = view
         self.keep_going = True
         self.key_space = False
+        self.select_start = None    # World position where a right-button selection drag started
 
     def update(self):
         for event in pygame.event.get():
@@ -723,20 +2586,45 @@ class Controller():
             elif event.type == KEYDOWN:
                 if event.key == K_ESCAPE or event.key == K_q:
                     self.keep_going = False
-            elif event.type == pygame.MOUSEBUTTONUP:
-                if Controller.edit_mode:
-                    mouse_pos = pygame.mouse.get_pos()
-                    if EDIT_BOX.collidepoint(mouse_pos):
+            elif event.type == pygame.MOUSEBUTTONDOWN and self.model.edit_mode:
+                # Left button paints with the brush, right button drags out a selection box
+                if event.button == 1:
+                    if EDIT_BOX.collidepoint(event.pos):
                         i = self.model.items.index(self.model.add_type)
                         self.model.add_type = self.model.items[(i + 1) % len(self.model.items)]
                     else:
-                        self.model.add_at(mouse_pos)
+                        self.model.begin_stroke(event.pos)
+                elif event.button == 3:
+                    self.select_start = (event.pos[0] + self.model.camX, event.pos[1] + self.model.camY)
+                    self._drag_select(event.pos)
+            elif event.type == pygame.MOUSEMOTION and self.model.edit_mode:
+                if self.model.stroke_last is not None:
+                    self.model.stroke_to(event.pos)
+                if self.select_start is not None:
+                    self._drag_select(event.pos)
+            elif event.type == pygame.MOUSEBUTTONUP:
+                if event.button == 1:
+                    self.model.end_stroke()
+                elif event.button == 3 and self.select_start is not None:
+                    self.model.select_rect(*self.model.select_box)
+                    self.model.select_box = None
+                    self.select_start = None
             elif event.type == pygame.KEYUP: #this is keyReleased!
                 if event.key == K_c:
                     self.model.clear_map()
                     print("Map cleared and game reset")
                 if event.key == K_e:
-                    Controller.edit_mode = not Controller.edit_mode
+                    self.model.edit_mode = not self.model.edit_mode
+                    self.model.end_stroke()
+                    self.model.selection = []
+                if event.key == K_DELETE or event.key == K_BACKSPACE:
+                    self.model.delete_selection()
+                if event.key == K_o:
+                    self.model.brush_overlap = not self.model.brush_overlap
+                if event.key == K_LEFTBRACKET:
+                    self.model.brush_spacing = max(10, self.model.brush_spacing - 10)
+                if event.key == K_RIGHTBRACKET:
+                    self.model.brush_spacing += 10
                 if event.key == K_l:
                     self.model.load_map()
                     print("Map loaded")
@@ -745,6 +2633,8 @@ class Controller():
                     print("Map saved")
                 if event.key == K_SPACE:
                     self.key_space = False
+                if event.key == K_p:
+                    self._toggle_profiler()
         
 
         keys = pygame.key.get_pressed()
@@ -758,25 +2648,339 @@ class Controller():
             dy -= LINK_SPEED
         if keys[K_DOWN]:
             dy += LINK_SPEED
-        self.model.link.set_input(dx, dy)
+        self.model.set_input(dx, dy)
 
         # Throws boomerang
-        if keys[K_SPACE] and not self.key_space and not Controller.edit_mode:
+        if keys[K_SPACE] and not self.key_space and not self.model.edit_mode:
             self.key_space = True
             self.model.throw_boomerang()
-        
-        Cucco.linkx = self.model.link.x + self.model.link.w/2
-        Cucco.linky = self.model.link.y + self.model.link.h/2
-
-print("Use the arrow keys to move. Press Esc to quit.")
-pygame.init()
-pygame.font.init()
-m = Model()
-v = View(m)
-c = Controller(m, v)
-while c.keep_going:
-    c.update()
-    m.update()
+
+    # Selection box from where the right button went down to the mouse, in world coordinates
+    def _drag_select(self, pos):
+        x0, y0 = self.select_start
+        x1 = pos[0] + self.model.camX
+        y1 = pos[1] + self.model.camY
+        self.model.select_box = (min(x0, x1), min(y0, y1), abs(x1 - x0), abs(y1 - y0))
+
+    # P turns the profiler on and off (while a trace is recording it only hides the overlay)
+    def _toggle_profiler(self):
+        prof = self.model.profiler
+        if prof is None:
+            self.model.profiler = Profiler()
+        elif prof.recording is not None:
+            prof.overlay = not prof.overlay
+        else:
+            self.model.profiler = None
+
+# Frame profiler
+# Times each phase of a tick, counts sprites, collision pairs and blits, and keeps a short history
+# for the overlay; record() keeps every tick for a Chrome trace or JSONL export
+# Off (Model.profiler is None) it costs nothing
+class Profiler():
+    def __init__(self, history=120):
+        self.history = deque(maxlen=history)
+        self.record = None          # Tick being measured
+        self.recording = None       # Every tick since record() was called
+        self.overlay = True
+        self.origin = time.perf_counter()
+
+    def begin_tick(self, tick):
+        self.record = {"tick": tick, "start": time.perf_counter() - self.origin, "phases": [], "counts": {}}
+        self.history.append(self.record)
+        if self.recording is not None:
+            self.recording.append(self.record)
+
+    # Runs fn and adds its wall time to the current tick
+    def time(self, name, fn, *args):
+        if self.record is None:
+            self.begin_tick(0)
+        t0 = time.perf_counter()
+        result = fn(*args)
+        t1 = time.perf_counter()
+        self.record["phases"].append((name, t0 - self.origin, t1 - t0))
+        return result
+
+    def end_tick(self, model):
+        counts = self.record["counts"]
+        counts.update(Counter(type(s).__name__ for s in model.sprites))
+        counts["pairs_tested"] = model.pairs_tested
+        counts["pairs_hit"] = model.pairs_hit
+        counts["boomerangs_in_use"] = model.boomerangs.in_use
+        counts["cuccos_near"], counts["cuccos_far"] = model.lod_last
+        counts["boomerangs_high_water"] = model.boomerangs.high_water
+
+    # Times a frame and records its blit counts (added to the last tick)
+    def render(self, view):
+        self.time("render", view.update)
+        counts = self.record["counts"]
+        counts["blits"] = view.blits
+        counts["drawn"] = view.drawn
+        counts["skipped"] = view.skipped
+
+    @staticmethod
+    def frame_ms(record):
+        return 1000 * sum(dur for _, _, dur in record["phases"])
+
+    # Average ms per phase over the history
+    def averages(self):
+        totals = {}
+        for r in self.history:
+            for name, _, dur in r["phases"]:
+                totals[name] = totals.get(name, 0.0) + dur
+        n = max(1, len(self.history))
+        return {name: 1000 * t / n for name, t in totals.items()}
+
+    def start_recording(self):
+        self.recording = []
+
+    # Writes the recorded ticks as JSONL (one tick per line) or a Chrome trace (chrome://tracing)
+    def export(self, path):
+        records = self.recording if self.recording is not None else list(self.history)
+        if path.endswith(".jsonl"):
+            with open(path, "w") as f:
+                for r in records:
+                    phases = {name: 1000 * dur for name, _, dur in r["phases"]}
+                    f.write(json.dumps({"tick": r["tick"], "phase_ms": phases, "counts": r["counts"]}) + "\n")
+            return
+        events = []
+        for r in records:
+            for name, start, dur in r["phases"]:
+                events.append({"name": name, "ph": "X", "ts": 1e6 * start, "dur": 1e6 * dur, "pid": 0, "tid": 0})
+            events.append({"name": "counts", "ph": "C", "ts": 1e6 * r["start"], "pid": 0, "args": r["counts"]})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events}, f)
+
+# Fixed-timestep game loop
+# The model always advances in 1/tick_rate steps; rendering runs on its own clock and
+# is skipped when the simulation is behind
+class GameLoop():
+    def __init__(self, tick_rate=TICK_RATE, render_rate=RENDER_RATE, max_catchup=MAX_CATCHUP_TICKS):
+        self.tick = 1.0 / tick_rate
+        self.frame = 1.0 / render_rate
+        self.max_catchup = max_catchup
+
+        # Counters
+        self.ticks = 0
+        self.renders = 0
+        self.skipped_renders = 0
+        self.skipped_in_row = 0
+        self.dropped_ticks = 0
+
+    def run(self, controller, model, view):
+        clock = time.perf_counter
+        prev = clock()
+        next_render = prev
+        acc = 0.0
+        while controller.keep_going:
+            now = clock()
+            acc += now - prev
+            prev = now
+
+            # Simulation catches up in fixed steps (capped so a slow tick can't snowball)
+            steps = 0
+            while acc >= self.tick and steps < self.max_catchup and controller.keep_going:
+                prof = model.profiler
+                if prof is None:
+                    controller.update()
+                    model.update()
+                else:
+                    prof.begin_tick(model.timers.tick + 1)
+                    prof.time("controller", controller.update)
+                    model.update()
+                    prof.end_tick(model)
+                acc -= self.tick
+                steps += 1
+            self.ticks += steps
+            behind = acc >= self.tick
+            if behind and steps == self.max_catchup:
+                dropped = int(acc // self.tick)
+                self.dropped_ticks += dropped
+                acc -= dropped * self.tick
+
+            # Draws when a frame is due, unless the frame would push the simulation further behind
+            # (only MAX_SKIPPED_RENDERS in a row, so the screen keeps moving when the game can't keep up)
+            now = clock()
+            if now >= next_render:
+                if behind and self.skipped_in_row < MAX_SKIPPED_RENDERS:
+                    self.skipped_renders += 1
+                    self.skipped_in_row += 1
+                else:
+                    if model.profiler is not None:
+                        model.profiler.render(view)
+                    else:
+                        view.update()
+                    self.renders += 1
+                    self.skipped_in_row = 0
+                next_render = max(next_render + self.frame, now)
+
+            # Sleeps until the next tick or frame is due
+            wait = min(self.tick - acc - (clock() - prev), next_render - clock())
+            if wait > 0:
+                sleep(wait)
+
+# Startup screen: a progress bar while the sprites decode
+def draw_loading(screen, text, done, total):
+    screen.fill((72, 152, 72))
+    label = text.get(f"Loading {done}/{total}", (255, 255, 255))
+    screen.blit(label, ((VIEW_W - label.get_width()) // 2, VIEW_H // 2 - 40))
+    bar = pygame.Rect(VIEW_W // 4, VIEW_H // 2, VIEW_W // 2, 16)
+    pygame.draw.rect(screen, (30, 90, 30), bar)
+    pygame.draw.rect(screen, (235, 255, 235), (bar.x, bar.y, bar.w * done // max(1, total), bar.h))
+    pygame.display.flip()
+
+# Opens the window and shows the loading bar while sprites decode on a thread pool and the map is parsed on another thread
+# Then builds the game and draws its first frame
+# Returns the model, the view and the startup times in seconds (first frame on screen, first game frame)
+def load_game(seed=None, start=None):
+    start = time.perf_counter() if start is None else start
+    screen = pygame.display.set_mode((VIEW_W, VIEW_H), 32)
+    images = ASSETS.preload(startup_images())
+    parser = ThreadPoolExecutor(max_workers=1)
+    mapdata = None if os.path.isdir(Model.filename) or is_binary_map(Model.filename) else parser.submit(read_map, Model.filename)
+    parser.shutdown(wait=False)
+
+    text = TextCache(32)
+    draw_loading(screen, text, 0, len(images))
+    times = {"first_frame": time.perf_counter() - start}
+    done = 0
+    while done < len(images):
+        pygame.event.pump()
+        sleep(0.005)
+        now = sum(1 for f in images if f.done())
+        if now != done:
+            done = now
+            draw_loading(screen, text, done, len(images))
+
+    m = Model(seed=seed, data=mapdata.result() if mapdata is not None else None)
+    v = View(m)
     v.update()
-    sleep(0.04)
-print("Goodbye!")
\ No newline at end of file
+    times["interactive"] = time.perf_counter() - start
+    return m, v, times
+
+# Starts pygame without a window (SDL dummy drivers)
+def init_headless():
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    pygame.init()
+    pygame.font.init()
+
+# Runs the model (and optionally the view) for a number of ticks as fast as possible
+# Returns ticks per second
+def run_headless(model, ticks, view=None):
+    start = time.perf_counter()
+    for _ in range(ticks):
+        prof = model.profiler
+        if prof is None:
+            model.update()
+            if view is not None:
+                view.update()
+            continue
+        prof.begin_tick(model.timers.tick + 1)
+        model.update()
+        prof.end_tick(model)
+        if view is not None:
+            prof.render(view)
+    elapsed = time.perf_counter() - start
+    return ticks / elapsed if elapsed > 0 else float("inf")
+
+# Replays a recording as fast as possible (optionally drawing it)
+# Returns the model, ticks per second and whether the final state hash matched
+def replay(path, render=False, profile=False, trace=None):
+    rec = Recording.load(path)
+    set_tick_rate(rec.tick_rate)
+    m = Model(seed=rec.seed)
+    m.autosave = False
+    m.restart(rec.seed, rec.map)
+    v = View(m) if render else None
+    _start_profiler(m, profile, trace)
+    events = rec.events
+    k = 0
+    start = time.perf_counter()
+    for t in range(rec.ticks):
+        while k < len(events) and events[k][0] == t:
+            m.apply(events[k][1:])
+            k += 1
+        run_headless(m, 1, v)
+    elapsed = time.perf_counter() - start
+    if trace:
+        m.profiler.export(trace)
+    tps = rec.ticks / elapsed if elapsed > 0 else float("inf")
+    return m, tps, m.state_hash() == rec.hash
+
+def _start_profiler(model, profile, trace):
+    if profile or trace:
+        model.profiler = Profiler()
+    if trace:
+        model.profiler.start_recording()
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+
+    # python game.py --atlas (packs sprites/ into sprites/atlas.png + atlas.json)
+    if args and args[0] == "--atlas":
+        init_headless()
+        (w, h), n = build_atlas()
+        print(f"Packed {n} sprites into {ATLAS_IMAGE} ({w}x{h})")
+        return
+
+    # python game.py --convert map.json map_folder [world_w world_h]
+    #                --convert map.json map.lkm (or back: --convert map.lkm map.json)
+    if args and args[0] == "--convert":
+        size = [int(n) for n in args[3:5]] if len(args) >= 5 else [None, None]
+        convert_map(args[1], args[2], *size)
+        print(f"Converted {args[1]} to {args[2]} ({WORLD_W}x{WORLD_H})")
+        return
+
+    # --profile starts with the profiler on, --trace file records every tick and writes it on exit
+    trace = args[args.index("--trace") + 1] if "--trace" in args else None
+
+    # python game.py --replay session.json [--render] [--profile] [--trace out.json|out.jsonl]
+    if args and args[0] == "--replay":
+        init_headless()
+        m, tps, ok = replay(args[1], "--render" in args, "--profile" in args, trace)
+        print(f"{m.timers.tick} ticks, {len(m.sprites)} sprites, {tps:.1f} ticks/s, final state {'matches' if ok else 'DIFFERS'}")
+        sys.exit(0 if ok else 1)
+
+    # python game.py --headless [ticks] [--render] [--profile] [--trace out.json|out.jsonl]
+    if args and args[0] == "--headless":
+        ticks = int(args[1]) if len(args) > 1 and args[1].isdigit() else 1000
+        init_headless()
+        m = Model()
+        v = View(m) if "--render" in args else None
+        _start_profiler(m, "--profile" in args, trace)
+        tps = run_headless(m, ticks, v)
+        print(f"{ticks} ticks, {len(m.sprites)} sprites, {tps:.1f} ticks/s, cucco updates {m.lod_ticks[0]} near / {m.lod_ticks[1]} far")
+        if trace:
+            m.profiler.export(trace)
+        return
+
+    # python game.py [--tick-rate N] [--render-rate N] [--profile] [--trace out.json|out.jsonl] [--record session.json] [--seed N]
+    tick_rate = int(args[args.index("--tick-rate") + 1]) if "--tick-rate" in args else TICK_RATE
+    render_rate = int(args[args.index("--render-rate") + 1]) if "--render-rate" in args else RENDER_RATE
+    set_tick_rate(tick_rate)
+
+    print("Use the arrow keys to move. Press Esc to quit.")
+    start = time.perf_counter()
+    pygame.init()
+    pygame.font.init()
+    record = args[args.index("--record") + 1] if "--record" in args else None
+    seed = int(args[args.index("--seed") + 1]) if "--seed" in args else None
+    m, v, times = load_game(seed, start)
+    print(f"First frame after {1000 * times['first_frame']:.0f} ms, playable after {1000 * times['interactive']:.0f} ms")
+    c = Controller(m, v)
+    _start_profiler(m, "--profile" in args, trace)
+    if record:
+        m.start_recording()
+    GameLoop(tick_rate, render_rate).run(c, m, v)
+    if trace:
+        m.profiler.export(trace)
+    if record:
+        rec = m.stop_recording(record)
+        print(f"Recorded {rec.ticks} ticks to {record}")
+    if m.autosave:
+        m.autosave_now()
+    m.saver.wait()
+    print("Goodbye!")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file